@@ -1,15 +1,20 @@
 import json
 import os
-import requests
 import smtplib
 from email.message import EmailMessage
 from email.mime.text import MIMEText
 from email.headerregistry import Address
 import ssl
 import dotenv
+import metrics
+import sessions
+import storage
 import asyncio
 import threading
-from telegram import Update
+import time
+from concurrent.futures import Future
+from telegram import Bot, Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 
 dotenv.load_dotenv()
@@ -18,12 +23,35 @@ SMTP_SERVER = os.getenv('SMTP_SERVER', 'localhost')
 SMTP_PORT = int(os.getenv('SMTP_PORT', 465))
 SMTP_USERNAME = os.getenv('SMTP_USERNAME', None)
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', None)
+# Emails sent over one SMTP session before reconnecting (many servers limit messages per connection)
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
 
 TG_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', None)
 TG_BOT_NAME = os.getenv('TELEGRAM_BOT', None)
 TG_app = None
 TG_bot_running = False
 
+# Maximum number of alerts combined into one digest message
+DIGEST_MAX_ALERTS = 50
+# Telegram rejects messages longer than 4096 characters (counted in UTF-16 code units)
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Discord allows up to 10 embeds per webhook message
+DISCORD_MAX_EMBEDS = 10
+DISCORD_MAX_RATE_LIMIT_RETRIES = int(os.getenv('DISCORD_MAX_RATE_LIMIT_RETRIES', 5))
+_discord_limits = {}  # webhook url or rate limit bucket -> time requests can resume
+_discord_buckets = {}  # webhook url -> rate limit bucket
+_discord_locks = {}  # webhook url -> lock
+_discord_state_lock = threading.Lock()
+
+# Telegram limits outgoing messages to about 30 per second overall and 1 per second per chat
+TG_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TG_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', 1))
+TG_SEND_TIMEOUT = float(os.getenv('TELEGRAM_SEND_TIMEOUT', 120))
+TG_sender_loop = None
+TG_sender_queue = None
+TG_sender_lock = threading.Lock()
+
 
 NOTIFICATION_TYPES = [
     {
@@ -34,6 +62,12 @@ NOTIFICATION_TYPES = [
                 "label": "Discord Webhook URL",
                 "type": "text",
                 "required": True
+            },
+            {
+                "name": "digest",
+                "label": "Combine alerts fired together into one digest",
+                "type": "checkbox",
+                "required": False
             }
         ],
         "description": "Send a notification to a Discord channel via webhook."
@@ -46,6 +80,12 @@ NOTIFICATION_TYPES = [
                 "label": "Email Address",
                 "type": "email",
                 "required": True
+            },
+            {
+                "name": "digest",
+                "label": "Combine alerts fired together into one digest",
+                "type": "checkbox",
+                "required": False
             }
         ],
         "description": "Send an email notification."
@@ -58,6 +98,12 @@ NOTIFICATION_TYPES = [
                 "label": "Username",
                 "type": "username",
                 "required": True
+            },
+            {
+                "name": "digest",
+                "label": "Combine alerts fired together into one digest",
+                "type": "checkbox",
+                "required": False
             }
         ],
         "description": "Send a telegram notification.",
@@ -71,29 +117,217 @@ NOTIFICATION_TYPES = [
 ]
 
 
-def handle_alert(domain: str, notification: dict, alert_data: dict):
+class PermanentAlertError(Exception):
+    """
+    Raised when an alert can never be delivered (unknown type, rejected destination), so retrying is pointless.
+    """
+
+
+def handle_alert(domain: str, notification: dict, alert_data: dict) -> bool:
     """
     Handle the alert for a domain.
+    Returns True if the alert was delivered, raises PermanentAlertError if it never can be.
     """
     alert_type = notification.get('type')
 
     if alert_type == 'discord_webhook':
-        discord_webhook(notification['url'], domain,
+        return discord_webhook(notification['url'], domain,
+                               alert_data, notification['blocks'])
+    elif alert_type == 'email':
+        return email(notification['email'], domain,
+                     alert_data, notification['blocks'])
+    elif alert_type == 'telegram':
+        return telegram(notification['username'], domain,
                         alert_data, notification['blocks'])
+    else:
+        raise PermanentAlertError(f"Unknown alert type: {alert_type} for domain: {domain}")
+
+
+def is_digest(notification: dict) -> bool:
+    """
+    Check if a notification has opted in to digest alerts.
+    """
+    return str(notification.get('digest', '')).lower() in ('true', 'on', '1', 'yes')
+
+
+def alert_destination(notification: dict) -> str | None:
+    """
+    Get where an alert is sent (webhook URL, email address or Telegram username).
+    """
+    for notification_type in NOTIFICATION_TYPES:
+        if notification_type['type'] == notification.get('type'):
+            return notification.get(notification_type['fields'][0]['name'])
+    return None
+
+
+def handle_alerts(alert_list: list, digest: bool = False) -> bool:
+    """
+    Handle a group of alerts for the same destination.
+    alert_list is a list of dicts with domain, notification and alert_data.
+    With digest the alerts are sent as a single message listing every domain,
+    otherwise Discord webhook alerts are combined into a single message with an embed each.
+    Returns True if every alert was delivered.
+    """
+    first = alert_list[0]['notification']
+    channel = first.get('type')
+    delivered = False
+    try:
+        with metrics.timed('firealerts_alert_send_seconds', channel=channel):
+            if digest and len(alert_list) > 1:
+                delivered = send_digest(first, alert_list)
+            elif channel == 'discord_webhook' and len(alert_list) > 1:
+                delivered = discord_webhook_alerts(first['url'], [
+                    (alert['domain'], alert['alert_data'], alert['notification']['blocks']) for alert in alert_list
+                ])
+            else:
+                delivered = all([handle_alert(alert['domain'], alert['notification'], alert['alert_data']) for alert in alert_list])
+        return delivered
+    finally:
+        metrics.inc('firealerts_alert_send_total', channel=channel, result='success' if delivered else 'failure')
+
+
+def _digest_lines(alert_list: list, code: bool = False) -> list:
+    """
+    Get one line per alert for a digest, soonest expiry first.
+    With code the domain is wrapped in backticks for Markdown.
+    """
+    alert_list = sorted(alert_list, key=lambda alert: alert['alert_data']['blocks'])
+    return [
+        f"{f'`{domain}`' if code else domain}: {alert['alert_data']['blocks']} blocks (~{alert['alert_data']['time']}), alert threshold {alert['notification']['blocks']} blocks"
+        for alert in alert_list
+        for domain in [alert['domain']]
+    ]
+
+
+def _telegram_digest(title: str, lines: list) -> str:
+    body = "\n".join(f"• {line}" for line in lines)
+    return f"""🔥 *FireAlerts Digest*
+
+{title}:
+{body}
+
+[Open your FireAlerts account](https://alerts.firewallet.au/account)"""
+
+
+def _digest_title(count: int) -> str:
+    return f"{count} of your domains are expiring soon"
+
+
+def _telegram_length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def digest_chunks(alert_list: list) -> list:
+    """
+    Split the alerts for one digest destination into groups that each fit in a single message.
+    Telegram digests are split by message length, other channels every DIGEST_MAX_ALERTS alerts.
+    """
+    alert_list = sorted(alert_list, key=lambda alert: alert['alert_data']['blocks'])
+    if alert_list[0]['notification'].get('type') != 'telegram':
+        return [alert_list[i:i + DIGEST_MAX_ALERTS] for i in range(0, len(alert_list), DIGEST_MAX_ALERTS)]
+
+    # The title with the largest count is the longest one any chunk can have
+    overhead = _telegram_length(_telegram_digest(_digest_title(len(alert_list)), []))
+    chunks = [[]]
+    length = overhead
+    for alert, line in zip(alert_list, _digest_lines(alert_list, code=True)):
+        size = _telegram_length(f"• {line}\n")
+        if chunks[-1] and length + size > TELEGRAM_MAX_MESSAGE_LENGTH:
+            chunks.append([])
+            length = overhead
+        chunks[-1].append(alert)
+        length += size
+    return chunks
+
+
+def send_digest(notification: dict, alert_list: list) -> bool:
+    """
+    Send a single digest message listing every alert in alert_list.
+    notification is one of the alerts' notifications, they all share its type and destination.
+    """
+    alert_type = notification.get('type')
+    lines = _digest_lines(alert_list)
+    title = _digest_title(len(alert_list))
+
+    if alert_type == 'discord_webhook':
+        # Keep each embed description well under Discord's limit
+        embeds = []
+        for i in range(0, len(lines), 25):
+            embeds.append({
+                "author": {
+                    "name": "FireAlerts",
+                    "icon_url": "https://firewallet.au/assets/img/FW.png"
+                },
+                "title": title,
+                "color": 13041919,
+                "description": "\n".join(lines[i:i + 25])
+            })
+        data = {
+            "username": "FireAlerts",
+            "avatar_url": "https://firewallet.au/assets/img/FW.png",
+            "embeds": embeds[:DISCORD_MAX_EMBEDS]
+        }
+        return _discord_post(f"{notification['url']}?with_components=true", data)
     elif alert_type == 'email':
-        email(notification['email'], domain,
-              alert_data, notification['blocks'])
+        body = "\n".join(f"- {line}" for line in lines)
+        return _send_email(notification['email'], title, f"""
+You set alerts for these domains:
+
+{body}
+
+Visit your FireAlerts account: https://alerts.firewallet.au/account
+""")
     elif alert_type == 'telegram':
-        telegram(notification['username'], domain,
-                 alert_data, notification['blocks'])
+        user_id = _telegram_user_id(notification['username'])
+        if not user_id:
+            return False
+        return send_telegram_message(user_id, _telegram_digest(title, _digest_lines(alert_list, code=True)))
     else:
-        print(f"Unknown alert type: {alert_type} for domain: {domain}")
+        raise PermanentAlertError(f"Unknown alert type: {alert_type} for digest")
+
+
+def _discord_embed(domain: str, content: dict, alert_blocks: int) -> dict:
+    """
+    Build the Discord embed for a single alert.
+    """
+    return {
+        "author": {
+            "name": "FireAlerts",
+            "icon_url": "https://firewallet.au/assets/img/FW.png"
+        },
+        "title": f"{domain} is expiring in {content['blocks']} blocks (~{content['time']})",
+        "color": 13041919,
+        "description": f"You set an alert for {domain}. This domain will expire in {content['blocks']} blocks or approximately {content['time']}.",
+        "fields": [
+            {
+                "name": "Domain",
+                "value": domain,
+                "inline": True
+            },
+            {
+                "name": "Notice Blocks",
+                "value": f"{alert_blocks}",
+                "inline": True
+            }
+        ]
+    }
 
 
-def discord_webhook(webhook_url: str, domain: str, content: dict, alert_blocks: int):
+def discord_webhook(webhook_url: str, domain: str, content: dict, alert_blocks: int) -> bool:
     """
     Send a message to a Discord webhook.
     """
+    return discord_webhook_alerts(webhook_url, [(domain, content, alert_blocks)])
+
+
+def discord_webhook_alerts(webhook_url: str, alert_list: list) -> bool:
+    """
+    Send up to DISCORD_MAX_EMBEDS alerts to a Discord webhook as one message with an embed per alert.
+    alert_list is a list of (domain, content, alert_blocks).
+    """
+    account_url = "https://alerts.firewallet.au/account"
+    if len(alert_list) == 1:
+        account_url = f"{account_url}/{alert_list[0][0]}"
 
     data = {
         "username": "FireAlerts",
@@ -105,53 +339,168 @@ def discord_webhook(webhook_url: str, domain: str, content: dict, alert_blocks:
                         {
                             "type": 2,
                             "style": 5,
-                            "url": f"https://alerts.firewallet.au/account/{domain}",
+                            "url": account_url,
                             "label": "Open your FireAlerts account"
                         }
                     ]
             }
         ],
-        "embeds": [
-            {
-                "author": {
-                    "name": "FireAlerts",
-                    "icon_url": "https://firewallet.au/assets/img/FW.png"
-                },
-                "title": f"{domain} is expiring in {content['blocks']} blocks (~{content['time']})",
-                "color": 13041919,
-                "description": f"You set an alert for {domain}. This domain will expire in {content['blocks']} blocks or approximately {content['time']}.",
-                "fields": [
-                    {
-                        "name": "Domain",
-                        "value": domain,
-                        "inline": True
-                    },
-                    {
-                        "name": "Notice Blocks",
-                        "value": f"{alert_blocks}",
-                        "inline": True
-                    }
-                ]
-            }
-        ]
+        "embeds": [_discord_embed(domain, content, alert_blocks)
+                   for domain, content, alert_blocks in alert_list[:DISCORD_MAX_EMBEDS]]
     }
     print(json.dumps(data, indent=4))  # Debugging output
-    response = requests.post(f"{webhook_url}?with_components=true", json=data)
-    if response.status_code != 204:
-        print(
-            f"Failed to send Discord webhook: {response.status_code} - {response.text}")
+    return _discord_post(f"{webhook_url}?with_components=true", data)
 
 
-def email(email_addr: str, domain: str, content: dict, alert_blocks: int):
+def _discord_wait(key: str):
     """
-    Send an email notification.
+    Sleep until the rate limit for a webhook (or its bucket) has reset.
     """
+    with _discord_state_lock:
+        key = _discord_buckets.get(key, key)
+        resume_at = _discord_limits.get(key, 0)
+    delay = resume_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
 
-    message = EmailMessage()
-    message['Subject'] = f"{domain} is expiring in {content['blocks']} blocks (~{content['time']})"
-    message['From'] = f'FireAlerts <{SMTP_USERNAME}>'
-    message['To'] = email_addr
-    message.set_content(f"""
+
+def _discord_post(url: str, data: dict) -> bool:
+    """
+    Post to a Discord webhook, honouring its rate limit headers.
+    Requests to the same webhook are sent one at a time and wait out Retry-After on a 429.
+    """
+    webhook = url.split('?', 1)[0]
+    with _discord_state_lock:
+        webhook_lock = _discord_locks.setdefault(webhook, threading.Lock())
+
+    with webhook_lock:
+        for attempt in range(DISCORD_MAX_RATE_LIMIT_RETRIES + 1):
+            _discord_wait(webhook)
+            response = sessions.discord().post(url, json=data)
+
+            # Remember the bucket the webhook belongs to and when it frees up
+            headers = response.headers
+            bucket = headers.get('X-RateLimit-Bucket')
+            with _discord_state_lock:
+                if bucket:
+                    _discord_buckets[webhook] = bucket
+                key = _discord_buckets.get(webhook, webhook)
+                if headers.get('X-RateLimit-Remaining') == '0' and headers.get('X-RateLimit-Reset-After'):
+                    _discord_limits[key] = time.time() + float(headers['X-RateLimit-Reset-After'])
+
+            if response.status_code == 429:
+                retry_after = headers.get('Retry-After')
+                if retry_after is None:
+                    try:
+                        retry_after = response.json().get('retry_after')
+                    except ValueError:
+                        pass
+                retry_after = float(retry_after or 1)
+                print(f"Discord rate limited, retrying in {retry_after} seconds")
+                with _discord_state_lock:
+                    _discord_limits[key] = time.time() + retry_after
+                continue
+
+            if 400 <= response.status_code < 500:
+                # Deleted webhook, bad URL or rejected message, sending it again won't help
+                raise PermanentAlertError(f"Discord webhook rejected: {response.status_code} - {response.text}")
+            if response.status_code not in (200, 204):
+                print(
+                    f"Failed to send Discord webhook: {response.status_code} - {response.text}")
+                return False
+            return True
+
+    print(f"Giving up on Discord webhook after {DISCORD_MAX_RATE_LIMIT_RETRIES} rate limited attempts")
+    return False
+
+
+class EmailSender:
+    """
+    Keep one authenticated SMTP session open to send many emails.
+    Reconnects when the server drops the session or the per-connection message limit is reached.
+    """
+
+    def __init__(self):
+        self.server = None
+        self.sent = 0
+
+    def _connect(self):
+        print(f"Attempting to connect to {SMTP_SERVER}:{SMTP_PORT}")
+        context = ssl.create_default_context()
+        server = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=context)
+        try:
+            if SMTP_USERNAME and SMTP_PASSWORD:
+                server.login(SMTP_USERNAME, SMTP_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.sent = 0
+
+    def close(self):
+        """
+        Close the SMTP session if one is open.
+        """
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def send(self, message: EmailMessage):
+        """
+        Send a message, opening or reopening the session as needed.
+        """
+        for attempt in range(2):
+            if self.server is None or self.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                self.close()
+                self._connect()
+            try:
+                self.server.send_message(message)  # type: ignore
+                self.sent += 1
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, ssl.SSLError) as e:
+                error = e
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:  # Service closing channel, e.g. too many messages
+                    raise
+                error = e
+            # The session went away, reconnect and try once more
+            self.server = None
+            if attempt:
+                raise error
+
+
+_email_senders = threading.local()
+
+
+def _get_email_sender() -> EmailSender:
+    """
+    Get the SMTP session for the current thread.
+    """
+    sender = getattr(_email_senders, 'sender', None)
+    if sender is None:
+        sender = EmailSender()
+        _email_senders.sender = sender
+    return sender
+
+
+def close_email_session():
+    """
+    Close the current thread's SMTP session, e.g. once there are no more emails waiting.
+    """
+    sender = getattr(_email_senders, 'sender', None)
+    if sender:
+        sender.close()
+
+
+def email(email_addr: str, domain: str, content: dict, alert_blocks: int) -> bool:
+    """
+    Send an email notification.
+    """
+    return _send_email(email_addr, f"{domain} is expiring in {content['blocks']} blocks (~{content['time']})", f"""
 You set an alert for {domain}. This domain will expire in {content['blocks']} blocks or approximately {content['time']}.
 
 Domain: {domain}
@@ -162,14 +511,23 @@ Alert threshold: {alert_blocks} blocks
 Visit your FireAlerts account: https://alerts.firewallet.au/account/{domain}
 """)
 
+
+def _send_email(email_addr: str, subject: str, body: str) -> bool:
+    """
+    Send an email through the current thread's SMTP session.
+    """
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = f'FireAlerts <{SMTP_USERNAME}>'
+    message['To'] = email_addr
+    message.set_content(body)
+
     try:
-        print(f"Attempting to connect to {SMTP_SERVER}:{SMTP_PORT}")
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=context) as server:
-            if SMTP_USERNAME and SMTP_PASSWORD:
-                server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(message)
-        print(f"Email sent to {email_addr} for domain {domain}")
+        _get_email_sender().send(message)
+        print(f"Email sent to {email_addr}: {subject}")
+        return True
+    except smtplib.SMTPRecipientsRefused as e:
+        raise PermanentAlertError(f"Email address {email_addr} refused: {e}")
     except smtplib.SMTPException as e:
         print(f"SMTP error sending email to {email_addr}: {e}")
     except ConnectionRefusedError as e:
@@ -177,6 +535,7 @@ Visit your FireAlerts account: https://alerts.firewallet.au/account/{domain}
             f"Connection refused to SMTP server {SMTP_SERVER}:{SMTP_PORT} - {e}")
     except Exception as e:
         print(f"Unexpected error sending email to {email_addr}: {e}")
+    return False
 
 
 async def link_tg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -196,7 +555,7 @@ async def link_tg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     # Try to validate the token
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
+    user_data = sessions.login().get("https://login.hns.au/auth/user", params={"token": token})
     if user_data.status_code != 200:
         await update.message.reply_text("Invalid token. Please try again.")
         return
@@ -208,26 +567,26 @@ async def link_tg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     if not os.path.exists('data'):
         os.makedirs('data')
-    if not os.path.exists('data/telegram.json'):
-        with open('data/telegram.json', 'w') as f:
-            json.dump({}, f)
-
-    # Load existing Telegram data
-    with open('data/telegram.json', 'r') as f:
-        telegram_data = json.load(f)
 
     if not update.message.from_user:
         await update.message.reply_text("Could not retrieve your Telegram user information.")
         return
-    # Update or add the user
-    telegram_data[user_name] = {
-        "user_id": update.message.from_user.id,
-        "username": update.message.from_user.username
-    }
 
-    # Save the updated data
-    with open('data/telegram.json', 'w') as f:
-        json.dump(telegram_data, f, indent=4)
+    with storage.file_lock('data/telegram.json'):
+        # Load existing Telegram data
+        telegram_data = {}
+        if os.path.exists('data/telegram.json'):
+            with open('data/telegram.json', 'r') as f:
+                telegram_data = json.load(f)
+
+        # Update or add the user
+        telegram_data[user_name] = {
+            "user_id": update.message.from_user.id,
+            "username": update.message.from_user.username
+        }
+
+        # Save the updated data
+        storage.write_json('data/telegram.json', telegram_data, indent=4)
 
     await update.message.reply_text(f'You have linked your Telegram account with username: {user_name}. You will now receive notifications for your domains.')
 
@@ -380,32 +739,42 @@ def stopTGBot():
     print("Stopping Telegram bot...")
 
 
-def telegram(username: str, domain: str, content: dict, alert_blocks: int):
+def _telegram_user_id(username: str) -> int | None:
     """
-    Send a Telegram notification.
+    Get the Telegram chat id linked to a FireAlerts username.
+    Returns None if the link data can't be read, raises PermanentAlertError if the user never linked Telegram.
     """
     # Load Telegram user data
     if not os.path.exists('data/telegram.json'):
         print(
             f"No Telegram data file found. Cannot send notification to {username}")
-        return
+        return None
 
     try:
         with open('data/telegram.json', 'r') as f:
             telegram_data = json.load(f)
     except Exception as e:
         print(f"Error reading Telegram data: {e}")
-        return
+        return None
 
     if username not in telegram_data:
-        print(
+        raise PermanentAlertError(
             f"Username {username} not found in Telegram data. User needs to link their account.")
-        return
 
     user_id = telegram_data[username].get('user_id')
     if not user_id:
-        print(f"No user_id found for username {username}")
-        return
+        raise PermanentAlertError(f"No user_id found for username {username}")
+    return user_id
+
+
+def telegram(username: str, domain: str, content: dict, alert_blocks: int) -> bool:
+    """
+    Send a Telegram notification.
+    Returns True if the message was sent.
+    """
+    user_id = _telegram_user_id(username)
+    if not user_id:
+        return False
 
     # Create the message
     message = f"""🔥 *FireAlerts Notification*
@@ -416,56 +785,135 @@ Alert threshold: {alert_blocks} blocks
 
 [Open your FireAlerts account](https://alerts.firewallet.au/account/{domain})"""
 
-    # Send the message in a separate thread with its own bot instance
-    def send_telegram_message():
-        loop = None
-        local_app = None
-        try:
-            # Create a new event loop for this thread
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+    sent = send_telegram_message(user_id, message)
+    if sent:
+        print(
+            f"Telegram notification sent to {username} (ID: {user_id}) for domain {domain}")
+    return sent
 
-            async def send_message():
-                nonlocal local_app
-                try:
-                    if not TG_BOT_TOKEN:
-                        print("Telegram bot token is not set. Cannot send message.")
-                        return
-                    
-                    # Create a new bot instance for this thread
-                    local_app = ApplicationBuilder().token(TG_BOT_TOKEN).build()
-                    await local_app.initialize()
-                    
-                    await local_app.bot.send_message(
-                        chat_id=user_id,
-                        text=message,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-                    print(
-                        f"Telegram notification sent to {username} (ID: {user_id}) for domain {domain}")
-                except Exception as e:
-                    print(f"Error sending Telegram message to {username}: {e}")
-                finally:
-                    if local_app:
-                        try:
-                            await local_app.shutdown()
-                        except Exception as e:
-                            print(f"Error shutting down local Telegram app: {e}")
 
-            # Run the async function
-            loop.run_until_complete(send_message())
+async def _run_tg_sender(ready: threading.Event):
+    """
+    Send queued Telegram messages through a single long-lived bot.
+    Pending messages are drained in batches and sent as fast as Telegram's rate limits allow.
+    """
+    global TG_sender_queue
+    TG_sender_queue = asyncio.Queue()
+    bot = Bot(TG_BOT_TOKEN)  # type: ignore
+    try:
+        await bot.initialize()
+    except Exception as e:
+        print(f"Error initializing Telegram sender: {e}")
+    ready.set()
+
+    next_send = 0.0  # Earliest time the next message can go out (global limit)
+    chat_next_send = {}  # chat_id -> earliest time the next message to that chat can go out
+    pending = []
+    while True:
+        if not pending:
+            pending.append(await TG_sender_queue.get())
+        while not TG_sender_queue.empty():
+            pending.append(TG_sender_queue.get_nowait())
+        # Drop messages whose sender gave up waiting, the alert gets retried instead
+        pending = [message for message in pending if not message[2].cancelled()]
+        if not pending:
+            continue
+
+        # Send the oldest message whose chat isn't rate limited
+        now = time.monotonic()
+        ready_at = min(max(next_send, chat_next_send.get(chat_id, 0.0)) for chat_id, _, _ in pending)
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+            continue
+        index = next(i for i, (chat_id, _, _) in enumerate(pending)
+                     if max(next_send, chat_next_send.get(chat_id, 0.0)) <= now)
+        chat_id, text, future = pending.pop(index)
+        if not future.running() and not future.set_running_or_notify_cancel():
+            continue  # Cancelled since it was picked
 
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+            future.set_result(True)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            retry_after = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)  # type: ignore
+            print(f"Telegram rate limit hit, waiting {retry_after} seconds")
+            next_send = time.monotonic() + retry_after
+            pending.insert(0, (chat_id, text, future))
+            continue
+        except (BadRequest, Forbidden) as e:
+            # Chat not found or the user blocked the bot
+            future.set_exception(PermanentAlertError(f"Telegram rejected message to {chat_id}: {e}"))
         except Exception as e:
-            print(f"Error in Telegram message thread: {e}")
-        finally:
+            print(f"Error sending Telegram message to {chat_id}: {e}")
+            future.set_result(False)
+
+        now = time.monotonic()
+        next_send = now + 1 / TG_GLOBAL_RATE
+        chat_next_send[chat_id] = now + TG_CHAT_INTERVAL
+        # Forget chats that are no longer rate limited
+        for chat in [chat for chat, at in chat_next_send.items() if at <= now]:
+            del chat_next_send[chat]
+
+
+def _start_tg_sender() -> bool:
+    """
+    Start the Telegram sender thread if it isn't running.
+    """
+    with TG_sender_lock:
+        if TG_sender_loop is not None and TG_sender_loop.is_running():
+            return True
+        if not TG_BOT_TOKEN:
+            print("Telegram bot token is not set. Cannot send message.")
+            return False
+
+        ready = threading.Event()
+
+        def run_sender():
+            global TG_sender_loop
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            TG_sender_loop = loop
             try:
-                if loop and not loop.is_closed():
-                    loop.close()
+                loop.run_until_complete(_run_tg_sender(ready))
             except Exception as e:
-                print(f"Error closing Telegram message loop: {e}")
+                print(f"Telegram sender stopped: {e}")
+            finally:
+                ready.set()
+                loop.close()
+
+        sender_thread = threading.Thread(target=run_sender, name="telegram-sender", daemon=True)
+        sender_thread.start()
+        ready.wait()
+        return TG_sender_loop is not None and TG_sender_loop.is_running()
+
 
-    # Start the message sending in a daemon thread
-    message_thread = threading.Thread(
-        target=send_telegram_message, daemon=True)
-    message_thread.start()
+def send_telegram_message(chat_id: int, text: str) -> bool:
+    """
+    Queue a Markdown message on the Telegram sender and wait for it to be sent.
+    A message still queued after TG_SEND_TIMEOUT seconds is cancelled so it is never sent late.
+    Returns True if the message was sent, raises PermanentAlertError if Telegram rejected it.
+    """
+    if not _start_tg_sender() or TG_sender_loop is None or TG_sender_queue is None:
+        return False
+
+    future = Future()
+    TG_sender_loop.call_soon_threadsafe(TG_sender_queue.put_nowait, (chat_id, text, future))
+    try:
+        return future.result(timeout=TG_SEND_TIMEOUT)
+    except TimeoutError:
+        if future.cancel():
+            # Still queued, take it off the sender so a retry can't send it twice
+            print(f"Timed out sending Telegram message to {chat_id}")
+            return False
+    # Already being sent, wait for the result so it isn't retried as well
+    try:
+        return future.result(timeout=TG_SEND_TIMEOUT)
+    except TimeoutError:
+        print(f"Timed out sending Telegram message to {chat_id}")
+        return False
@@ -0,0 +1,326 @@
+"""
+Benchmark the expiry scan and notification store against a mock HSD node.
+
+Generates synthetic data/domains.json stores, runs each size in a fresh process
+and prints the results as JSON so runs can be compared between releases.
+
+Usage: python benchmark.py [--sizes 1000,10000] [--latency 0.005] [--backend json] [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_FILE = 'bench_result.json'
+HSD_PORTS = {'main': 12037, 'testnet': 13037, 'regtest': 14037, 'simnet': 15037}
+
+# Chain height the mock node reports, scans run at this height and the next one
+BASE_HEIGHT = 200000
+ALERT_BLOCKS = 1008
+NOTIFICATIONS_PER_DOMAIN = 2
+NOTIFICATIONS_PER_USER = 20
+
+
+class MockHSD(BaseHTTPRequestHandler):
+    """
+    Answers getinfo and (batched) getnameinfo like an HSD node, and accepts Discord webhook posts.
+    Names starting with "due" expire exactly ALERT_BLOCKS after BASE_HEIGHT so their alerts fire.
+    With webhook_limit set each webhook is rate limited like Discord's: webhook_limit posts every
+    webhook_window seconds, then 429s with Retry-After until the bucket resets.
+    """
+    latency = 0.0
+    webhook_limit = 0
+    webhook_window = 2.0
+    webhook_buckets = {}  # webhook path -> (window start, posts in window)
+    stats = {"requests": 0, "names": 0, "webhooks": 0, "rate_limited": 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, data=None, headers: dict | None = None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def name_info(name: str) -> dict:
+        if name.startswith('due'):
+            expiry = BASE_HEIGHT + ALERT_BLOCKS
+        else:
+            expiry = BASE_HEIGHT + ALERT_BLOCKS + 100 + zlib.crc32(name.encode()) % 50000
+        return {"info": {"name": name, "stats": {"renewalPeriodEnd": expiry}}}
+
+    def do_GET(self):
+        if self.path == '/bench/stats':
+            with self.stats_lock:
+                return self._send(200, dict(self.stats))
+        time.sleep(self.latency)
+        self._send(200, {"chain": {"height": BASE_HEIGHT}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+        if self.path.startswith('/webhooks/'):
+            return self._webhook()
+
+        time.sleep(self.latency)
+        calls = body if isinstance(body, list) else [body]
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['names'] += len(calls)
+        results = [
+            {"id": call.get('id'), "error": None, "result": self.name_info(call['params'][0])}
+            for call in calls
+        ]
+        self._send(200, results if isinstance(body, list) else results[0])
+
+
+    def _webhook(self):
+        if not self.webhook_limit:
+            with self.stats_lock:
+                self.stats['webhooks'] += 1
+            return self._send(204)
+
+        now = time.monotonic()
+        with self.stats_lock:
+            start, posts = self.webhook_buckets.get(self.path, (now, 0))
+            if now - start >= self.webhook_window:
+                start, posts = now, 0
+            limited = posts >= self.webhook_limit
+            if limited:
+                self.stats['rate_limited'] += 1
+            else:
+                posts += 1
+                self.stats['webhooks'] += 1
+            self.webhook_buckets[self.path] = (start, posts)
+        reset_after = f"{max(0.0, self.webhook_window - (now - start)):.3f}"
+        headers = {
+            'X-RateLimit-Limit': str(self.webhook_limit),
+            'X-RateLimit-Remaining': str(self.webhook_limit - posts),
+            'X-RateLimit-Reset-After': reset_after,
+            'X-RateLimit-Bucket': f"{zlib.crc32(self.path.encode()):08x}",
+        }
+        if limited:
+            headers['Retry-After'] = reset_after
+            return self._send(429, {"message": "You are being rate limited.", "retry_after": float(reset_after),
+                                    "global": False}, headers)
+        self._send(204, headers=headers)
+
+
+def start_mock_hsd(port: int, latency: float, webhook_limit: int = 0, webhook_window: float = 2.0) -> ThreadingHTTPServer:
+    """
+    Start the mock HSD node in a background thread.
+    """
+    MockHSD.latency = latency
+    MockHSD.webhook_limit = webhook_limit
+    MockHSD.webhook_window = webhook_window
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockHSD)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_store(path: str, size: int, port: int, due_fraction: float, seed: int):
+    """
+    Write a domains.json store with size notifications.
+    The file is written a domain at a time so large stores don't have to fit in memory here.
+    """
+    rng = random.Random(seed)
+    domain_count = max(1, size // NOTIFICATIONS_PER_DOMAIN)
+    due_every = max(1, round(1 / due_fraction)) if due_fraction > 0 else 0
+    written = 0
+    with open(path, 'w') as f:
+        f.write('{')
+        for i in range(domain_count):
+            prefix = 'due' if due_every and i % due_every == 0 else 'bench'
+            count = NOTIFICATIONS_PER_DOMAIN if i < domain_count - 1 else size - written
+            notifications = []
+            for _ in range(count):
+                user = f"user{rng.randrange(max(1, size // NOTIFICATIONS_PER_USER))}"
+                notifications.append({
+                    "blocks": ALERT_BLOCKS,
+                    "type": "discord_webhook",
+                    "url": f"http://127.0.0.1:{port}/webhooks/{user}",
+                    "user_name": user,
+                    "id": f"{rng.getrandbits(128):032x}",
+                })
+            written += count
+            f.write(('' if i == 0 else ',') + json.dumps(f"{prefix}{i}") + ':' + json.dumps(notifications))
+        f.write('}')
+
+
+def _latencies(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+def _hsd_stats(port: int) -> dict:
+    import requests
+    return requests.get(f'http://127.0.0.1:{port}/bench/stats', timeout=10).json()
+
+
+def run_size(size: int, port: int, ops: int, seed: int) -> dict:
+    """
+    Benchmark one store in the current working directory (run in a fresh process by main).
+    """
+    sys.path.insert(0, REPO_DIR)
+    result = {"size": size}
+
+    start = time.perf_counter()
+    import domains
+    import delivery
+    result['store_load_seconds'] = time.perf_counter() - start
+    result['domains'] = len(domains.get_domains())
+
+    delivery_before = _hsd_stats(port)
+    # Cold scan fetches every expiry, the warm scan at the next height is served from the expiry cache
+    for label, height in (('scan_cold', BASE_HEIGHT), ('scan_warm', BASE_HEIGHT + 1)):
+        before = _hsd_stats(port)
+        start = time.perf_counter()
+        domains.notify_expiries(height)
+        elapsed = time.perf_counter() - start
+        after = _hsd_stats(port)
+        result[label] = {
+            "seconds": elapsed,
+            "hsd_requests": after['requests'] - before['requests'],
+            "hsd_names": after['names'] - before['names'],
+        }
+
+    start = time.perf_counter()
+    delivery.wait_idle(600)
+    metrics = delivery.get_metrics()['discord_webhook']
+    result['alerts'] = {
+        "delivery_seconds": time.perf_counter() - start,
+        "sent": metrics['sent'],
+        "messages": metrics['messages'],
+        "failed": metrics['failed'],
+        "rate_limited": _hsd_stats(port)['rate_limited'] - delivery_before['rate_limited'],
+    }
+
+    rng = random.Random(seed)
+    users = [f"user{rng.randrange(max(1, size // NOTIFICATIONS_PER_USER))}" for _ in range(ops)]
+    added = []
+    samples = []
+    for i, user in enumerate(users):
+        notification = {"blocks": ALERT_BLOCKS, "type": "discord_webhook", "url": f"http://127.0.0.1:{port}/webhooks/{user}",
+                        "user_name": user, "id": f"benchadd{i}"}
+        start = time.perf_counter()
+        domains.add_notification(f"benchadd{i}", notification)
+        samples.append(time.perf_counter() - start)
+        added.append((notification['id'], user))
+    result['add_notification'] = _latencies(samples)
+
+    samples = []
+    for user in users:
+        start = time.perf_counter()
+        domains.get_account_notifications(user)
+        samples.append(time.perf_counter() - start)
+    result['get_account_notifications'] = _latencies(samples)
+
+    samples = []
+    for notification_id, user in added:
+        start = time.perf_counter()
+        domains.delete_notification(notification_id, user)
+        samples.append(time.perf_counter() - start)
+    result['delete_notification'] = _latencies(samples)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_memory_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the expiry scan and notification store.")
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help="Comma separated store sizes (notifications)")
+    parser.add_argument('--latency', type=float, default=0.005, help="Mock HSD latency per request in seconds")
+    parser.add_argument('--backend', default='json', choices=['json', 'sqlite'], help="Storage backend")
+    parser.add_argument('--ops', type=int, default=20, help="Operations timed for each store call")
+    parser.add_argument('--due-fraction', type=float, default=0.01, help="Fraction of domains with an alert due")
+    parser.add_argument('--webhook-limit', type=int, default=0,
+                        help="Posts each mock webhook accepts per --webhook-window before answering 429 (0 for no limit)")
+    parser.add_argument('--webhook-window', type=float, default=2.0, help="Mock webhook rate limit window in seconds")
+    parser.add_argument('--network', default='regtest', choices=list(HSD_PORTS),
+                        help="HSD network, the mock node listens on its port")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Also write the results to this file")
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    port = HSD_PORTS[args.network]
+
+    if args.run_size is not None:
+        result = run_size(args.run_size, port, args.ops, args.seed)
+        with open(RESULT_FILE, 'w') as f:
+            json.dump(result, f)
+        return
+
+    server = start_mock_hsd(port, args.latency, args.webhook_limit, args.webhook_window)
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+            workdir = tempfile.mkdtemp(prefix=f'firealerts-bench-{size}-')
+            try:
+                os.makedirs(os.path.join(workdir, 'data'))
+                print(f"Generating store with {size} notifications...", file=sys.stderr)
+                generate_store(os.path.join(workdir, 'data', 'domains.json'), size, port, args.due_fraction, args.seed)
+
+                env = dict(os.environ, HSD_URL='127.0.0.1', HSD_NETWORK=args.network, HSD_API_KEY='',
+                           HSD_EVENTS='false', STORAGE_BACKEND=args.backend)
+                print(f"Running benchmark for {size} notifications...", file=sys.stderr)
+                process = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--run-size', str(size), '--ops', str(args.ops),
+                     '--network', args.network, '--seed', str(args.seed)],
+                    cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                if process.returncode != 0:
+                    print(process.stderr, file=sys.stderr)
+                    results.append({"size": size, "error": f"Benchmark process exited with {process.returncode}"})
+                    continue
+                with open(os.path.join(workdir, RESULT_FILE), 'r') as f:
+                    results.append(json.load(f))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "hsd_latency": args.latency,
+        "webhook_limit": args.webhook_limit,
+        "results": results,
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+import dotenv
+import alerts
+import metrics
+import outbox
+
+dotenv.load_dotenv()
+
+# Bounded queue size and number of delivery workers for each alert type
+# (ALERT_WORKERS_<TYPE>, e.g. ALERT_WORKERS_TELEGRAM, overrides the worker count for one type)
+ALERT_QUEUE_SIZE = int(os.getenv('ALERT_QUEUE_SIZE', 1000))
+ALERT_WORKERS = int(os.getenv('ALERT_WORKERS', 2))
+# Failed deliveries are retried with exponential backoff starting at ALERT_RETRY_DELAY seconds,
+# after ALERT_MAX_RETRIES retries they keep being retried every ALERT_RETRY_MAX_DELAY seconds
+ALERT_MAX_RETRIES = int(os.getenv('ALERT_MAX_RETRIES', 5))
+ALERT_RETRY_DELAY = float(os.getenv('ALERT_RETRY_DELAY', 2))
+ALERT_RETRY_MAX_DELAY = float(os.getenv('ALERT_RETRY_MAX_DELAY', 300))
+# Seconds a worker waits for more alerts before closing its connections
+ALERT_IDLE_TIMEOUT = float(os.getenv('ALERT_IDLE_TIMEOUT', 10))
+
+CHANNELS = [notification_type['type'] for notification_type in alerts.NOTIFICATION_TYPES]
+
+_queues = {}  # channel -> queue.Queue of jobs
+_queues_lock = threading.Lock()
+_retries = []  # (retry at, sequence, job)
+_retry_sequence = itertools.count()
+_retry_condition = threading.Condition()
+_retry_thread = None
+
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+def _reset():
+    """
+    Start with no queues, workers or counters.
+    Also run in forked processes as the parent's worker threads don't exist there.
+    """
+    global _queues_lock, _retries, _retry_condition, _retry_thread, _metrics_lock, _metrics
+    _queues.clear()
+    _queues_lock = threading.Lock()
+    _retries = []
+    _retry_condition = threading.Condition()
+    _retry_thread = None
+    _metrics_lock = threading.Lock()
+    _metrics = {
+        channel: {"sent": 0, "messages": 0, "failed": 0, "retried": 0, "latency_total": 0.0, "latency_max": 0.0}
+        for channel in CHANNELS
+    }
+
+
+_reset()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def _get_queue(channel: str) -> queue.Queue:
+    """
+    Get the queue for an alert type, starting its workers on first use.
+    """
+    global _retry_thread
+    with _queues_lock:
+        if channel in _queues:
+            return _queues[channel]
+
+        channel_queue = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        _queues[channel] = channel_queue
+        workers = int(os.getenv(f'ALERT_WORKERS_{channel.upper()}', ALERT_WORKERS))
+        for i in range(workers):
+            worker = threading.Thread(target=_worker, args=(channel, channel_queue),
+                                      name=f"alerts-{channel}-{i}", daemon=True)
+            worker.start()
+
+        if _retry_thread is None:
+            _retry_thread = threading.Thread(target=_retry_worker, name="alerts-retry", daemon=True)
+            _retry_thread.start()
+        return channel_queue
+
+
+def enqueue_alerts(alert_list: list):
+    """
+    Queue a batch of alerts (dicts with domain, notification, alert_data and key) for delivery.
+    Discord webhook alerts for the same webhook are combined into messages of up to 10 embeds,
+    and alerts for notifications with digest enabled are combined into one message per destination.
+    Blocks while the queue for an alert type is full so a slow channel slows the scan down instead of growing without bound.
+    """
+    jobs = []
+    discord_groups = {}
+    digest_groups = {}
+    for alert in alert_list:
+        channel = alert['notification'].get('type')
+        if channel not in CHANNELS:
+            print(f"Unknown alert type: {channel} for domain: {alert['domain']}")
+            if alert.get('key'):
+                outbox.mark_failed(alert['key'])
+        elif alerts.is_digest(alert['notification']):
+            digest_groups.setdefault((channel, alerts.alert_destination(alert['notification'])), []).append(alert)
+        elif channel == 'discord_webhook':
+            discord_groups.setdefault(alert['notification']['url'], []).append(alert)
+        else:
+            jobs.append(_job(channel, [alert]))
+
+    for group in discord_groups.values():
+        for i in range(0, len(group), alerts.DISCORD_MAX_EMBEDS):
+            jobs.append(_job('discord_webhook', group[i:i + alerts.DISCORD_MAX_EMBEDS]))
+
+    for (channel, _), group in digest_groups.items():
+        for chunk in alerts.digest_chunks(group):
+            jobs.append(_job(channel, chunk, digest=True))
+
+    for job in jobs:
+        _get_queue(job['channel']).put(job)
+
+
+def _job(channel: str, alert_list: list, digest: bool = False) -> dict:
+    return {
+        "channel": channel,
+        "alerts": alert_list,
+        "digest": digest,
+        "domains": ", ".join(alert['domain'] for alert in alert_list),
+        "attempts": 0,
+        "queued_at": time.time(),
+    }
+
+
+def replay_outbox() -> int:
+    """
+    Queue every alert left in the outbox by a previous run.
+    Returns the number of alerts queued.
+    """
+    records = outbox.pending()
+    if records:
+        print(f"Replaying {len(records)} undelivered alerts from the outbox")
+        enqueue_alerts(records)
+    return len(records)
+
+
+def _deliver(job: dict) -> str:
+    """
+    Send a queued alert (or group of alerts).
+    Returns 'done', 'retry' if sending failed, or 'failed' if it never can succeed.
+    """
+    try:
+        return 'done' if alerts.handle_alerts(job['alerts'], job.get('digest', False)) else 'retry'
+    except alerts.PermanentAlertError as e:
+        print(f"Can't send {job['channel']} alert for {job['domains']}: {e}")
+        return 'failed'
+    except Exception as e:
+        print(f"Error sending {job['channel']} alert for {job['domains']}: {e}")
+        return 'retry'
+
+
+def _finish(job: dict, status: str):
+    """
+    Mark every alert in a job as finished in the outbox.
+    """
+    for alert in job['alerts']:
+        if alert.get('key'):
+            if status == 'done':
+                outbox.mark_done(alert['key'])
+            else:
+                outbox.mark_failed(alert['key'])
+
+
+def _worker(channel: str, channel_queue: queue.Queue):
+    """
+    Deliver alerts from a channel queue until the process exits.
+    """
+    while True:
+        try:
+            job = channel_queue.get(timeout=ALERT_IDLE_TIMEOUT)
+        except queue.Empty:
+            # Nothing left to send from this scan, don't hold SMTP sessions open
+            if channel == 'email':
+                alerts.close_email_session()
+            job = channel_queue.get()
+        try:
+            job['attempts'] += 1
+            result = _deliver(job)
+            if result == 'done':
+                _record_delivery(channel, time.time() - job['queued_at'], len(job['alerts']))
+                _finish(job, 'done')
+            elif result == 'retry':
+                # Outages can last longer than the backoff, the alert stays in the outbox until it is delivered
+                _schedule_retry(job)
+            else:
+                with _metrics_lock:
+                    _metrics[channel]['failed'] += len(job['alerts'])
+                _finish(job, 'failed')
+        finally:
+            channel_queue.task_done()
+
+
+def _schedule_retry(job: dict):
+    """
+    Retry a failed alert after an exponential backoff, then every ALERT_RETRY_MAX_DELAY seconds.
+    """
+    if job['attempts'] > ALERT_MAX_RETRIES:
+        delay = ALERT_RETRY_MAX_DELAY
+        if job['attempts'] == ALERT_MAX_RETRIES + 1:
+            print(f"{job['channel']} alert for {job['domains']} still failing after {ALERT_MAX_RETRIES} retries")
+    else:
+        delay = min(ALERT_RETRY_DELAY * 2 ** (job['attempts'] - 1), ALERT_RETRY_MAX_DELAY)
+    print(f"Retrying {job['channel']} alert for {job['domains']} in {delay} seconds")
+    with _metrics_lock:
+        _metrics[job['channel']]['retried'] += 1
+    with _retry_condition:
+        heapq.heappush(_retries, (time.time() + delay, next(_retry_sequence), job))
+        _retry_condition.notify()
+
+
+def _retry_worker():
+    """
+    Move alerts back onto their queue once their backoff has passed.
+    """
+    while True:
+        with _retry_condition:
+            while not _retries or _retries[0][0] > time.time():
+                timeout = _retries[0][0] - time.time() if _retries else None
+                _retry_condition.wait(timeout)
+            _, _, job = heapq.heappop(_retries)
+        _get_queue(job['channel']).put(job)
+
+
+def _record_delivery(channel: str, latency: float, count: int):
+    with _metrics_lock:
+        metrics = _metrics[channel]
+        metrics['sent'] += count
+        metrics['messages'] += 1
+        metrics['latency_total'] += latency
+        metrics['latency_max'] = max(metrics['latency_max'], latency)
+
+
+def get_metrics() -> dict:
+    """
+    Get queue depth and delivery counters for each alert type.
+    sent counts alerts and messages counts the messages they were delivered in.
+    Latency is measured from when a message was queued to when it was delivered.
+    """
+    with _retry_condition:
+        retrying = {}
+        for _, _, job in _retries:
+            retrying[job['channel']] = retrying.get(job['channel'], 0) + 1
+
+    metrics = {}
+    with _metrics_lock:
+        for channel in CHANNELS:
+            channel_queue = _queues.get(channel)
+            channel_metrics = dict(_metrics[channel])
+            channel_metrics['queue_depth'] = channel_queue.qsize() if channel_queue else 0
+            channel_metrics['retrying'] = retrying.get(channel, 0)
+            channel_metrics['latency_avg'] = (
+                channel_metrics['latency_total'] / channel_metrics['messages'] if channel_metrics['messages'] else 0.0)
+            metrics[channel] = channel_metrics
+    return metrics
+
+
+def _collect_metrics() -> list:
+    """
+    Report the delivery counters and queue depths on /metrics.
+    """
+    collected = []
+    for channel, channel_metrics in get_metrics().items():
+        labels = {"channel": channel}
+        collected += [
+            ('counter', 'firealerts_alerts_sent_total', labels, channel_metrics['sent']),
+            ('counter', 'firealerts_alert_messages_total', labels, channel_metrics['messages']),
+            ('counter', 'firealerts_alerts_failed_total', labels, channel_metrics['failed']),
+            ('counter', 'firealerts_alerts_retried_total', labels, channel_metrics['retried']),
+            ('counter', 'firealerts_alert_delivery_latency_seconds_total', labels, channel_metrics['latency_total']),
+            ('gauge', 'firealerts_alert_delivery_latency_seconds_max', labels, channel_metrics['latency_max']),
+            ('gauge', 'firealerts_alert_queue_depth', labels, channel_metrics['queue_depth']),
+            ('gauge', 'firealerts_alerts_retrying', labels, channel_metrics['retrying']),
+        ]
+    return collected
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def wait_idle(timeout: float | None = None) -> bool:
+    """
+    Wait until every queued alert has been delivered or given up on.
+    Returns False if the timeout passed first.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        with _retry_condition:
+            retrying = len(_retries)
+        busy = retrying or any(q.unfinished_tasks for q in list(_queues.values()))
+        if not busy:
+            return True
+        if deadline is not None and time.time() > deadline:
+            return False
+        time.sleep(0.1)
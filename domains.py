@@ -1,8 +1,16 @@
 import json
 import os
-import requests
 import dotenv
-import alerts
+import threading
+import time
+import heapq
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import delivery
+import metrics
+import outbox
+import sessions
+import storage
 dotenv.load_dotenv()
 
 HSD_URL = os.getenv('HSD_URL', 'localhost')
@@ -17,22 +25,43 @@ HSD_PORTS = {
 }
 HSD_PORT = HSD_PORTS.get(HSD_NETWORK, 12037)
 
+# Number of getnameinfo calls sent per JSON-RPC batch and number of batches in flight
+HSD_BATCH_SIZE = max(1, int(os.getenv('HSD_BATCH_SIZE', 50)))
+HSD_CONCURRENCY = max(1, int(os.getenv('HSD_CONCURRENCY', 4)))
+
+# Maximum age (in blocks) of a cached expiry height before it gets fetched again
+EXPIRY_CACHE_MAX_AGE = max(1, int(os.getenv('EXPIRY_CACHE_MAX_AGE', 144)))
+EXPIRY_CACHE_FILE = 'data/expiry_cache.json'
+# Expiries looked up for the API are kept in memory per process (up to this many names) instead of EXPIRY_CACHE_FILE
+EXPIRY_API_CACHE_SIZE = max(1, int(os.getenv('EXPIRY_API_CACHE_SIZE', 10000)))
+
+# Number of fired alerts whose last_block_notified is saved in a single store write
+ALERT_COMMIT_BATCH = max(1, int(os.getenv('ALERT_COMMIT_BATCH', 100)))
+
+# Seconds a chain height recorded by the expiry checker is served to the API for,
+# and how long a height fetched by the API itself is reused when the checker isn't running
+TIP_CACHE_MAX_AGE = int(os.getenv('TIP_CACHE_MAX_AGE', 180))
+TIP_CACHE_TTL = int(os.getenv('TIP_CACHE_TTL', 15))
+TIP_CACHE_FILE = 'data/tip.json'
+
+# Maximum number of missed blocks to catch up on when the checker falls behind
+MAX_CATCHUP_BLOCKS = max(1, int(os.getenv('MAX_CATCHUP_BLOCKS', 144)))
+
 HSD_URL_FULL = f'http://x:{HSD_API_KEY}@{HSD_URL}:{HSD_PORT}' if HSD_API_KEY else f'http://{HSD_URL}:{HSD_PORT}'
 print(f"Using HSD URL: {HSD_URL_FULL}")
 
 if not os.path.exists('data'):
     os.makedirs('data')
 
-if not os.path.exists('data/domains.json'):
-    with open('data/domains.json', 'w') as f:
-        json.dump({}, f)
+_storage = storage.get_storage()
 
 
 def get_current_block() -> int:
     """
     Get the current block number from the HSD node.
     """
-    response = requests.get(HSD_URL_FULL)
+    with metrics.timed('firealerts_hsd_request_seconds', method='getinfo'):
+        response = sessions.hsd().get(HSD_URL_FULL)
     
     if response.status_code != 200:
         print(f"Error fetching current block: {response.status_code} - {response.text}")
@@ -49,21 +78,15 @@ def get_current_block() -> int:
         return -1
     return chain_data['height']
 
-def get_domain_expiry_block(domain: str) -> int:
+def _parse_expiry_response(domain: str, data: dict) -> int:
     """
-    Get the expiry block of a domain.
+    Extract the expiry block from a getnameinfo response.
     """
-    response = requests.post(HSD_URL_FULL, json={ "method": "getnameinfo", "params":[domain] })
-        
-    if response.status_code != 200:
-        return -1
-    
-    data = response.json()
     if 'error' in data and data['error'] is not None:
         print(f"Error fetching data for {domain}: {data['error']}")
         return -1
 
-    if 'result' not in data or 'info' not in data['result']:
+    if not data.get('result') or 'info' not in data['result'] or not data['result']['info']:
         print(f"No result or info found for {domain}.")
         return -1
     
@@ -78,110 +101,688 @@ def get_domain_expiry_block(domain: str) -> int:
 
     return stats['renewalPeriodEnd']
 
+def get_domain_expiry_block(domain: str) -> int:
+    """
+    Get the expiry block of a domain.
+    """
+    metrics.inc('firealerts_hsd_names_total')
+    with metrics.timed('firealerts_hsd_request_seconds', method='getnameinfo'):
+        response = sessions.hsd().post(HSD_URL_FULL, json={ "method": "getnameinfo", "params":[domain] })
+        
+    if response.status_code != 200:
+        return -1
+    
+    return _parse_expiry_response(domain, response.json())
+
+def _get_domain_expiry_batch(batch: list) -> dict:
+    """
+    Get the expiry blocks of a batch of domains with a single JSON-RPC batch call.
+    """
+    payload = [{"method": "getnameinfo", "params": [domain], "id": i} for i, domain in enumerate(batch)]
+    try:
+        with metrics.timed('firealerts_hsd_request_seconds', method='getnameinfo_batch'):
+            response = sessions.hsd().post(HSD_URL_FULL, json=payload)
+    except Exception as e:
+        print(f"Error fetching expiry batch of {len(batch)} domains: {e}")
+        return {domain: -1 for domain in batch}
+
+    if response.status_code != 200:
+        print(f"Error fetching expiry batch: {response.status_code} - {response.text}")
+        return {domain: -1 for domain in batch}
+
+    data = response.json()
+    if not isinstance(data, list):
+        # Node doesn't support batching, fall back to one call per domain
+        print("HSD node returned a non batch response, falling back to single lookups.")
+        results = {}
+        for domain in batch:
+            try:
+                results[domain] = get_domain_expiry_block(domain)
+            except Exception as e:
+                print(f"Error fetching data for {domain}: {e}")
+                results[domain] = -1
+        return results
+
+    metrics.inc('firealerts_hsd_names_total', len(batch))
+    results = {domain: -1 for domain in batch}
+    for item in data:
+        i = item.get('id')
+        if not isinstance(i, int) or i < 0 or i >= len(batch):
+            continue
+        results[batch[i]] = _parse_expiry_response(batch[i], item)
+    return results
+
+def get_domain_expiry_blocks(domain_list: list) -> dict:
+    """
+    Get the expiry blocks of many domains.
+    Lookups are sent in JSON-RPC batches of HSD_BATCH_SIZE with up to HSD_CONCURRENCY batches in flight.
+    Domains that fail to resolve map to -1.
+    """
+    domain_list = list(dict.fromkeys(domain_list))
+    if not domain_list:
+        return {}
+
+    batches = [domain_list[i:i + HSD_BATCH_SIZE] for i in range(0, len(domain_list), HSD_BATCH_SIZE)]
+    results = {}
+    if len(batches) == 1:
+        results.update(_get_domain_expiry_batch(batches[0]))
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(HSD_CONCURRENCY, len(batches))) as executor:
+        for batch_results in executor.map(_get_domain_expiry_batch, batches):
+            results.update(batch_results)
+    return results
+
+# region Tip cache
+# The latest chain height is shared between the expiry checker and every API worker
+# through TIP_CACHE_FILE so API reads don't need a round trip to the node.
+_tip = None  # {"height": height, "at": time recorded, "checker": recorded by the expiry checker}
+_tip_lock = threading.Lock()
+_tip_file = None
+_tip_file_version = None
+
+def _tip_is_fresh(tip: dict | None) -> bool:
+    if not tip:
+        return False
+    max_age = TIP_CACHE_MAX_AGE if tip.get('checker') else TIP_CACHE_TTL
+    return time.time() - tip['at'] < max_age
+
+def _read_tip_file() -> dict | None:
+    """
+    Read the shared tip cache, only parsing the file again when it has changed.
+    """
+    global _tip_file_version, _tip_file
+    try:
+        stat = os.stat(TIP_CACHE_FILE)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != _tip_file_version:
+            with open(TIP_CACHE_FILE, 'r') as f:
+                _tip_file = json.load(f)
+            _tip_file_version = version
+    except Exception:
+        return None
+    return _tip_file
+
+def record_current_block(height: int, checker: bool = False):
+    """
+    Share the current block with every process reading the tip cache.
+    """
+    global _tip
+    if height == -1:
+        return
+    tip = {"height": height, "at": time.time(), "checker": checker}
+    _tip = tip
+    try:
+        storage.write_json(TIP_CACHE_FILE, tip)
+    except Exception as e:
+        print(f"Error saving tip cache: {e}")
+
+def get_cached_current_block() -> int:
+    """
+    Get the current block from the tip cache.
+    Heights from the expiry checker are used for TIP_CACHE_MAX_AGE seconds,
+    after that the node is asked directly and the answer is shared for TIP_CACHE_TTL seconds.
+    """
+    global _tip
+    with _tip_lock:
+        tip = _read_tip_file()
+        if _tip_is_fresh(tip):
+            _tip = tip
+            return tip['height']
+
+        try:
+            height = get_current_block()
+        except Exception as e:
+            print(f"Error fetching current block: {e}")
+            height = -1
+        if height == -1:
+            # Serve the last known height rather than nothing while the node is unreachable
+            stale = _tip or tip
+            return stale['height'] if stale else -1
+        record_current_block(height)
+        return height
+
+# endregion
+
+# region Expiry cache
+# renewalPeriodEnd only changes when a name is renewed, transferred or revoked
+# so it is cached as {domain: {"expiry": height, "fetched": height}} across scans.
+_expiry_cache = None
+_expiry_cache_version = None  # (mtime, size) of EXPIRY_CACHE_FILE when it was last read or written
+_api_expiry_cache = OrderedDict()  # Lookups that aren't persisted, least recently fetched first
+_expiry_cache_lock = threading.Lock()
+
+def _load_expiry_cache() -> dict:
+    """
+    Load the expiry cache from disk.
+    """
+    if not os.path.exists(EXPIRY_CACHE_FILE):
+        return {}
+    try:
+        with open(EXPIRY_CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error reading expiry cache: {e}")
+        return {}
+
+def _expiry_cache_file_version():
+    try:
+        stat = os.stat(EXPIRY_CACHE_FILE)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _refresh_expiry_cache():
+    """
+    Pick up entries other processes saved since the cache was last read, only reading the file when it has changed.
+    Call with _expiry_cache_lock held.
+    """
+    global _expiry_cache, _expiry_cache_version
+    version = _expiry_cache_file_version()
+    if _expiry_cache is not None and version == _expiry_cache_version:
+        return
+    cache = _load_expiry_cache()
+    for domain, entry in (_expiry_cache or {}).items():
+        if domain not in cache or cache[domain]['fetched'] < entry['fetched']:
+            cache[domain] = entry
+    _expiry_cache = cache
+    _expiry_cache_version = version
+
+def _save_expiry_cache(current_block: int):
+    """
+    Save the expiry cache to disk, merging entries written by other processes.
+    Entries older than EXPIRY_CACHE_MAX_AGE are dropped as they would be refetched anyway.
+    """
+    global _expiry_cache, _expiry_cache_version
+    with storage.file_lock(EXPIRY_CACHE_FILE):
+        cache = _load_expiry_cache()
+        for domain, entry in (_expiry_cache or {}).items():
+            if domain not in cache or cache[domain]['fetched'] < entry['fetched']:
+                cache[domain] = entry
+        cache = {domain: entry for domain, entry in cache.items()
+                 if entry['fetched'] >= current_block - EXPIRY_CACHE_MAX_AGE}
+        storage.write_json(EXPIRY_CACHE_FILE, cache)
+        # The file now holds everything this process knows, no need to read it back
+        _expiry_cache = cache
+        _expiry_cache_version = _expiry_cache_file_version()
+
+def _expiry_refresh_interval(blocks_remaining: int, thresholds: list) -> int:
+    """
+    Get how many blocks a cached expiry stays valid for.
+    The interval shrinks as the name nears its next alert threshold so renewals are seen before alerting.
+    """
+    upcoming = [blocks_remaining - t for t in thresholds if t <= blocks_remaining]
+    distance = min(upcoming) if upcoming else blocks_remaining
+    if distance <= 0:
+        return EXPIRY_CACHE_MAX_AGE if not upcoming else 1
+    return max(1, min(EXPIRY_CACHE_MAX_AGE, distance // 4))
+
+def get_cached_expiry_blocks(domain_list: list, current_block: int, thresholds: dict | None = None,
+                             persist: bool = True) -> dict:
+    """
+    Get the expiry blocks of many domains, only fetching the ones with a missing or stale cache entry.
+    thresholds maps a domain to the alert blocks set for it and controls how often it gets refreshed.
+    Without persist (API lookups) fetched expiries only go to this process's in-memory cache,
+    so arbitrary names looked up through the public API never end up in EXPIRY_CACHE_FILE.
+    """
+    if current_block == -1:
+        return get_domain_expiry_blocks(domain_list)
+
+    thresholds = thresholds or {}
+    with _expiry_cache_lock:
+        _refresh_expiry_cache()
+
+        results = {}
+        stale = []
+        for domain in domain_list:
+            entry = _expiry_cache.get(domain)
+            if not persist:
+                api_entry = _api_expiry_cache.get(domain)
+                if api_entry is not None and (entry is None or api_entry['fetched'] > entry['fetched']):
+                    entry = api_entry
+            if entry is not None:
+                interval = _expiry_refresh_interval(entry['expiry'] - current_block, thresholds.get(domain, []))
+                if current_block - entry['fetched'] < interval:
+                    results[domain] = entry['expiry']
+                    continue
+            stale.append(domain)
+
+    if not stale:
+        return results
+
+    fetched = get_domain_expiry_blocks(stale)
+    with _expiry_cache_lock:
+        cache = _expiry_cache if persist else _api_expiry_cache
+        for domain in stale:
+            expiry_block = fetched.get(domain, -1)
+            if expiry_block == -1:
+                # Keep serving the last known expiry on lookup errors
+                entry = cache.get(domain) or _expiry_cache.get(domain)
+                results[domain] = entry['expiry'] if entry else -1
+                continue
+            cache[domain] = {"expiry": expiry_block, "fetched": current_block}
+            results[domain] = expiry_block
+        if not persist:
+            for domain in stale:
+                if domain in _api_expiry_cache:
+                    _api_expiry_cache.move_to_end(domain)
+            while len(_api_expiry_cache) > EXPIRY_API_CACHE_SIZE:
+                _api_expiry_cache.popitem(last=False)
+            return results
+        try:
+            _save_expiry_cache(current_block)
+        except Exception as e:
+            print(f"Error saving expiry cache: {e}")
+    return results
+
+def get_cached_expiry_block(domain: str, current_block: int, persist: bool = True) -> int:
+    """
+    Get the expiry block of a domain through the expiry cache.
+    """
+    return get_cached_expiry_blocks([domain], current_block, persist=persist).get(domain, -1)
+
+# endregion
+
+# region Trigger index
+# Notifications are indexed by the height at which they are due (expiry height - blocks)
+# and domains by the height their cached expiry goes stale, so each scan only has to look at
+# the alerts that are due and the expiries that need refreshing instead of every notification.
+_trigger_heap = []  # (trigger height, domain, notification id)
+_notification_blocks = {}  # domain -> {notification id: blocks}
+_domain_expiry = {}  # domain -> expiry height the domain was indexed with
+_refresh_heap = []  # (height, domain)
+_refresh_at = {}  # domain -> height its expiry is next refreshed at
+_trigger_index_version = None  # Store version the index reflects
+_trigger_index_lock = threading.RLock()
+
+# Names that don't resolve (not registered yet or never looked up successfully) are retried about hourly
+MISSING_EXPIRY_RETRY_BLOCKS = 6
+
+def _schedule_refresh(domain: str, height: int):
+    """
+    Refresh the expiry of a domain at height, or earlier if it was already due before then.
+    """
+    with _trigger_index_lock:
+        if _refresh_at.get(domain, height + 1) <= height:
+            return
+        _refresh_at[domain] = height
+        heapq.heappush(_refresh_heap, (height, domain))
+
+def _push_trigger(domain: str, notification_id: str):
+    expiry_block = _domain_expiry.get(domain)
+    if expiry_block is not None:
+        heapq.heappush(_trigger_heap, (expiry_block - _notification_blocks[domain][notification_id], domain, notification_id))
+
+def _index_notification(domain: str, notification: dict):
+    """
+    Add a notification to the trigger index, or update it if its blocks changed.
+    The domain expiry is checked on the next scan so the new threshold is seen with a fresh expiry.
+    """
+    with _trigger_index_lock:
+        entries = _notification_blocks.setdefault(domain, {})
+        if entries.get(notification['id']) == notification['blocks']:
+            return
+        entries[notification['id']] = notification['blocks']
+        _push_trigger(domain, notification['id'])
+        _schedule_refresh(domain, 0)
+
+def _unindex_notification(domain: str, notification_id: str):
+    """
+    Remove a notification from the trigger index.
+    Stale heap entries are skipped when they are popped.
+    """
+    with _trigger_index_lock:
+        entries = _notification_blocks.get(domain)
+        if entries is None:
+            return
+        entries.pop(notification_id, None)
+        if not entries:
+            del _notification_blocks[domain]
+            _domain_expiry.pop(domain, None)
+            _refresh_at.pop(domain, None)
+
+def _index_domain(domain: str, expiry_block: int):
+    """
+    Reindex all notifications of a domain for a new expiry height.
+    """
+    with _trigger_index_lock:
+        if expiry_block == -1:
+            _domain_expiry.pop(domain, None)
+            return
+        _domain_expiry[domain] = expiry_block
+        for notification_id in _notification_blocks.get(domain, {}):
+            _push_trigger(domain, notification_id)
+
+def _rebuild_trigger_index(notification_blocks: dict):
+    """
+    Rebuild the trigger index from the notification blocks of the whole store.
+    Known expiries are kept, domains that are new or whose notifications changed get refreshed on this scan.
+    """
+    global _trigger_heap, _notification_blocks, _refresh_heap
+    with _trigger_index_lock:
+        for domain in list(_domain_expiry):
+            if domain not in notification_blocks:
+                del _domain_expiry[domain]
+        for domain in list(_refresh_at):
+            if domain not in notification_blocks:
+                del _refresh_at[domain]
+        for domain, entries in notification_blocks.items():
+            if _notification_blocks.get(domain) != entries:
+                _refresh_at[domain] = 0
+        _notification_blocks = notification_blocks
+        _trigger_heap = [
+            (_domain_expiry[domain] - blocks, domain, notification_id)
+            for domain, entries in notification_blocks.items() if domain in _domain_expiry
+            for notification_id, blocks in entries.items()
+        ]
+        heapq.heapify(_trigger_heap)
+        _refresh_heap = [(height, domain) for domain, height in _refresh_at.items()]
+        heapq.heapify(_refresh_heap)
+
+def _write_store(write, reindex=None):
+    """
+    Run a store write and keep the trigger index in step with it.
+    If another process changed the store since the index was built the index is left stale
+    so the next scan rebuilds it, the same way MemoryStorage handles its copy.
+    reindex is called with the result of write when the index was current.
+    """
+    global _trigger_index_version
+    with _trigger_index_lock, _storage.lock():
+        current = _storage.version() == _trigger_index_version
+        result = write()
+        if current:
+            if reindex:
+                reindex(result)
+            _trigger_index_version = _storage.version()
+        return result
+
+def _sync_trigger_index():
+    """
+    Bring the trigger index up to date if the store was changed by another process.
+    The changes are applied one by one, the index is only rebuilt when the store no longer has them.
+    """
+    global _trigger_index_version
+    with _trigger_index_lock:
+        version = _storage.version()
+        if version == _trigger_index_version:
+            return
+        changes = None
+        if _trigger_index_version is not None:
+            changes = _storage.changes_since(_trigger_index_version)
+        if changes is None:
+            _rebuild_trigger_index(_storage.get_notification_blocks())
+        else:
+            for op, domain, notification in changes:
+                if op == 'put':
+                    _index_notification(domain, notification)
+                else:
+                    _unindex_notification(domain, notification['id'])
+        _trigger_index_version = version
+
+def _refresh_expiries(current_block: int) -> list:
+    """
+    Refresh the expiry of every domain whose cached expiry is due for a refresh and reindex the ones that changed.
+    Returns the domains refreshed.
+    """
+    with _trigger_index_lock:
+        stale = []
+        while _refresh_heap and _refresh_heap[0][0] <= current_block:
+            height, domain = heapq.heappop(_refresh_heap)
+            if _refresh_at.get(domain) == height:
+                del _refresh_at[domain]
+                stale.append(domain)
+        thresholds = {domain: list(_notification_blocks[domain].values()) for domain in stale}
+    if not stale:
+        return stale
+
+    expiry_blocks = get_cached_expiry_blocks(stale, current_block, thresholds)
+    with _trigger_index_lock:
+        for domain, expiry_block in expiry_blocks.items():
+            if domain not in _notification_blocks:
+                continue  # Deleted while fetching
+            if _domain_expiry.get(domain, -1) != expiry_block:
+                _index_domain(domain, expiry_block)
+            if expiry_block == -1:
+                _schedule_refresh(domain, current_block + MISSING_EXPIRY_RETRY_BLOCKS)
+            else:
+                interval = _expiry_refresh_interval(expiry_block - current_block, thresholds[domain])
+                _schedule_refresh(domain, current_block + interval)
+    return stale
+
+def _pop_due_triggers(current_block: int) -> list:
+    """
+    Pop every notification that is due at the current height.
+    A notification is due while the current height is within one block of its trigger height.
+    Returns a list of (trigger height, domain, notification id, expiry height).
+    """
+    due = []
+    seen = set()
+    with _trigger_index_lock:
+        while _trigger_heap and _trigger_heap[0][0] - 1 <= current_block:
+            trigger, domain, notification_id = heapq.heappop(_trigger_heap)
+            blocks = _notification_blocks.get(domain, {}).get(notification_id)
+            expiry_block = _domain_expiry.get(domain)
+            if blocks is None or expiry_block is None or expiry_block - blocks != trigger:
+                continue  # Deleted or reindexed
+            if (domain, notification_id) in seen:
+                continue  # Pushed again by an expiry that changed back
+            seen.add((domain, notification_id))
+            if trigger >= current_block:
+                due.append((trigger, domain, notification_id, expiry_block))
+    return due
+
+# endregion
+
+def _reset_after_fork():
+    """
+    Give a forked process fresh locks and caches.
+    The expiry checker thread may have held one of the locks at the moment of the fork.
+    """
+    global _tip_lock, _expiry_cache, _expiry_cache_version, _api_expiry_cache, _expiry_cache_lock, _trigger_index_lock, _trigger_index_version
+    _tip_lock = threading.Lock()
+    _expiry_cache = None
+    _expiry_cache_version = None
+    _api_expiry_cache = OrderedDict()
+    _expiry_cache_lock = threading.Lock()
+    _trigger_index_lock = threading.RLock()
+    _trigger_index_version = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+@metrics.timed('firealerts_store_seconds', operation='get_domains')
 def get_domains() -> dict:
     """
-    Get the dict of domains from the JSON file.
+    Get the dict of domains from the notification store.
+    """
+    return _storage.get_domains()
+
+@metrics.timed('firealerts_store_seconds', operation='get_domain_notifications')
+def get_domain_notifications(domain_list) -> dict:
+    """
+    Get the notifications of some domains from the notification store.
     """
-    with open('data/domains.json', 'r') as f:
-        domains = json.load(f)
-    return domains
+    return _storage.get_domain_notifications(domain_list)
 
+@metrics.timed('firealerts_store_seconds', operation='add_notification')
 def add_notification(domain: str, notification: dict):
     """
     Add a notification for a domain.
     """
-    domains = get_domains()
-    if domain not in domains:
-        domains[domain] = []
-    domains[domain].append(notification)
-    
-    with open('data/domains.json', 'w') as f:
-        json.dump(domains, f, indent=4)
+    _write_store(lambda: _storage.add_notification(domain, notification),
+                 lambda _: _index_notification(domain, notification))
+
+@metrics.timed('firealerts_store_seconds', operation='add_notifications')
+def add_notifications(additions: list):
+    """
+    Add many (domain, notification) pairs with a single store write.
+    """
+    if not additions:
+        return
+    def reindex(_):
+        for domain, notification in additions:
+            _index_notification(domain, notification)
+
+    _write_store(lambda: _storage.add_notifications(additions), reindex)
 
+@metrics.timed('firealerts_store_seconds', operation='update_notification')
 def update_notification(domain: str, notification: dict):
     """
     Update a notification for a domain.
     """
-    domains = get_domains()
-    if domain in domains:
-        for i, existing_notification in enumerate(domains[domain]):
-            if existing_notification['type'] == notification['type'] and existing_notification['id'] == notification['id']:
-                domains[domain][i] = notification
-                break
-        else:
-            domains[domain].append(notification)
-    else:
-        domains[domain] = [notification]
-    
-    with open('data/domains.json', 'w') as f:
-        json.dump(domains, f, indent=4)
+    _write_store(lambda: _storage.update_notification(domain, notification),
+                 lambda _: _index_notification(domain, notification))
+
+@metrics.timed('firealerts_store_seconds', operation='update_notifications')
+def update_notifications(updates: list):
+    """
+    Update many (domain, notification) pairs with a single store write.
+    """
+    if not updates:
+        return
+    def reindex(_):
+        for domain, notification in updates:
+            _index_notification(domain, notification)
+
+    _write_store(lambda: _storage.update_notifications(updates), reindex)
 
+@metrics.timed('firealerts_store_seconds', operation='delete_notification')
 def delete_notification(notification_id: str, user_name: str):
     """
     Delete a notification for a domain.
     """
-    domains = get_domains()
-    domains_to_delete = []
-    
-    for domain in domains:
-        domains[domain] = [n for n in domains[domain] if n['id'] != notification_id or n.get('user_name') != user_name]
-        if not domains[domain]:
-            domains_to_delete.append(domain)
-    
-    # Remove empty domains after iteration
-    for domain in domains_to_delete:
-        del domains[domain]
-    
-    with open('data/domains.json', 'w') as f:
-        json.dump(domains, f, indent=4)
+    def reindex(domains_changed):
+        for domain in domains_changed:
+            _unindex_notification(domain, notification_id)
+
+    _write_store(lambda: _storage.delete_notification(notification_id, user_name), reindex)
+
+@metrics.timed('firealerts_store_seconds', operation='delete_notifications')
+def delete_notifications(notification_ids: list, user_name: str) -> list:
+    """
+    Delete many notifications with a single store write.
+    Returns the ids that were found and deleted.
+    """
+    if not notification_ids:
+        return []
+    def reindex(deleted):
+        for notification_id, domains_changed in deleted.items():
+            for domain in domains_changed:
+                _unindex_notification(domain, notification_id)
+
+    return list(_write_store(lambda: _storage.delete_notifications(notification_ids, user_name), reindex))
 
+@metrics.timed('firealerts_store_seconds', operation='get_account_notifications')
 def get_account_notifications(user_name: str) -> list:
     """
     Get all notifications for a specific account.
     """
-    domains = get_domains()
-    # For each notification check if user_name
-    notifications = []
-    for domain, domain_notifications in domains.items():
-        for notification in domain_notifications:
-            if notification.get('user_name') == user_name:
-                notifications.append({
-                    'domain': domain,
-                    'notification': notification
-                })
-    return notifications
+    return _storage.get_account_notifications(user_name)
+
+def iter_account_notifications(user_name: str, after: str | None = None):
+    """
+    Iterate over the notifications for an account in id order without building the whole list.
+    after is the id of the last notification already seen.
+    """
+    return _storage.iter_account_notifications(user_name, after)
+
+def get_user_version(user_name: str) -> str:
+    """
+    Get a tag that changes whenever one of a user's notifications changes.
+    """
+    return _storage.get_user_version(user_name)
 
 
-def notify_expiries():
+@metrics.timed('firealerts_scan_seconds')
+def notify_expiries(current_block: int | None = None):
     """
     Notify about the expiry of domains.
+    current_block defaults to the current chain tip.
     """
-    domains = get_domains()
-    if not domains:
+    _sync_trigger_index()
+    if not _notification_blocks:
         print("No domains found.")
         return
-    current_block = get_current_block()
-
+    if current_block is None:
+        current_block = get_current_block()
+    if current_block == -1:
+        print("Could not get the current block, skipping expiry check.")
+        return
+    refreshed = _refresh_expiries(current_block)
+    due = _pop_due_triggers(current_block)
+    notifications = get_domain_notifications({domain for _, domain, _, _ in due})
+    looked_at = len(set(refreshed).union(notifications))
+    metrics.inc('firealerts_scan_domains_total', looked_at)
+    metrics.set_gauge('firealerts_scan_last_domains', looked_at)
 
-    for domain in domains:
-        expiry_block = get_domain_expiry_block(domain)
-        if expiry_block == -1:
+    fired = []
+    queued = []
+    for trigger, domain, notification_id, expiry_block in due:
+        notification = next((n for n in notifications.get(domain, []) if n['id'] == notification_id), None)
+        if notification is None:
             continue
         blocks_remaining = expiry_block - current_block
         domain_data = {
             "blocks": blocks_remaining,
             "time": f"{blocks_remaining // 144} days"  # Assuming 144 blocks per day
         }
-        for notification in domains[domain]:
-            if notification['blocks'] <= blocks_remaining and notification['blocks'] >= (blocks_remaining - 1): # Just in case there are 2 blocks really close together
-                # Check if last block notified is more than current block + 5
-                if notification.get('last_block_notified', -1) < (current_block - 5):
-                    notification['last_block_notified'] = current_block
-                    # Update the notification
-                    update_notification(domain, notification)
-                    # Handle the alert
-                    alerts.handle_alert(domain, notification, domain_data)
-            
+        # Check if last block notified is more than current block + 5
+        if notification.get('last_block_notified', -1) < (current_block - 5):
+            notification['last_block_notified'] = current_block
+            fired.append((domain, notification, domain_data, outbox.alert_key(notification, trigger)))
+            if len(fired) >= ALERT_COMMIT_BATCH:
+                queued += _record_alerts(fired)
+                fired = []
+    queued += _record_alerts(fired)
+    # Queued once for the whole scan so digests and Discord messages group every alert of this block
+    delivery.enqueue_alerts(queued)
+
+
+def _record_alerts(fired: list) -> list:
+    """
+    Record a batch of fired alerts in the outbox and save their last_block_notified in one write.
+    Alerts recorded in the outbox are replayed at startup if the process dies before they are delivered,
+    and their key (notification id and trigger height) stops the same alert being sent twice.
+    Returns the outbox records that still have to be queued for delivery.
+    """
+    if not fired:
+        return []
+    metrics.inc('firealerts_alerts_fired_total', len(fired))
+    new = outbox.add([
+        {"key": key, "domain": domain, "notification": notification, "alert_data": domain_data}
+        for domain, notification, domain_data, key in fired
+    ])
+    update_notifications([(domain, notification) for domain, notification, _, _ in fired])
+    return new
+
+
+# Last block height notify_expiries was run for
+_last_processed_block = None
+
+def check_new_blocks() -> int:
+    """
+    Run notify_expiries for each block mined since the last check.
+    Does nothing if the chain tip has not moved.
+    Returns the number of blocks processed.
+    """
+    global _last_processed_block
+    current_block = get_current_block()
+    if current_block == -1:
+        print("Could not get the current block, skipping expiry check.")
+        return 0
+    record_current_block(current_block, checker=True)
+
+    if _last_processed_block is None or current_block < _last_processed_block:
+        # First run or reorg to a lower tip
+        heights = [current_block]
+    else:
+        start = max(_last_processed_block + 1, current_block - MAX_CATCHUP_BLOCKS + 1)
+        heights = list(range(start, current_block + 1))
+
+    for height in heights:
+        notify_expiries(height)
+        _last_processed_block = height
+    return len(heights)
 
 
 if __name__ == "__main__":
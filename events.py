@@ -0,0 +1,316 @@
+import json
+import os
+import threading
+import time
+import dotenv
+import domains
+
+dotenv.load_dotenv()
+
+# Listen for new blocks on the HSD node socket instead of only polling
+HSD_EVENTS = os.getenv('HSD_EVENTS', 'false').lower() == 'true'
+HSD_WS_URL = os.getenv('HSD_WS_URL', f'ws://{domains.HSD_URL}:{domains.HSD_PORT}/socket.io/?transport=websocket')
+
+BLOCK_EVENTS = ('chain connect', 'block connect')
+
+_new_block = threading.Event()
+_listener_running = False
+_connected = False
+
+
+def _parse_event(packet: str) -> tuple | None:
+    """
+    Parse a bsock (socket.io style) packet.
+    Returns (packet type, ack id, payload) or None if the packet isn't a socket message.
+    """
+    # Engine packet 4 = message, socket packet 2 = event, 3 = ack, 5 = binary event
+    if len(packet) < 2 or packet[0] != '4':
+        return None
+    packet_type = packet[1]
+    body = packet[2:]
+    if packet_type == '5' and '-' in body:
+        body = body.split('-', 1)[1]  # Drop the attachment count
+    ack_id = ''
+    while body and body[0].isdigit():
+        ack_id += body[0]
+        body = body[1:]
+    try:
+        payload = json.loads(body) if body else []
+    except ValueError:
+        return None
+    return packet_type, int(ack_id) if ack_id else None, payload
+
+
+def _listen(url: str):
+    """
+    Connect to the HSD node socket and set the new block flag for every connected block.
+    Returns when the connection is closed.
+    """
+    global _connected
+    import websocket
+
+    ws = websocket.create_connection(url, timeout=30)
+    try:
+        ping_interval = 25
+        calls = {}
+        next_id = 0
+        last_message = time.time()
+
+        def call(event: str, *args):
+            nonlocal next_id
+            calls[next_id] = event
+            ws.send(f'42{next_id}' + json.dumps([event, *args]))
+            next_id += 1
+
+        while _listener_running:
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                if time.time() - last_message > ping_interval * 2:
+                    print("HSD socket timed out.")
+                    return
+                ws.send('2')  # Ping
+                continue
+            last_message = time.time()
+
+            if isinstance(message, bytes):
+                continue  # Binary attachments (raw block entries) aren't needed
+            if not message:
+                return
+
+            if message[0] == '0':
+                # Engine open packet
+                handshake = json.loads(message[1:] or '{}')
+                ping_interval = handshake.get('pingInterval', 25000) / 1000
+                ws.settimeout(ping_interval)
+            elif message[0] == '1':
+                print("HSD socket closed by node.")
+                return
+            elif message[0] == '2':
+                ws.send('3')  # Pong
+            elif message == '40':
+                # Socket connected
+                if domains.HSD_API_KEY:
+                    call('auth', domains.HSD_API_KEY)
+                call('watch chain')
+            else:
+                event = _parse_event(message)
+                if event is None:
+                    continue
+                packet_type, ack_id, payload = event
+                if packet_type == '3':
+                    name = calls.pop(ack_id, None)
+                    if payload and payload[0] is not None:
+                        print(f"HSD socket call {name} failed: {payload[0]}")
+                        return
+                    if name == 'watch chain':
+                        print("Listening for new blocks on the HSD socket.")
+                        _connected = True
+                        _new_block.set()  # Catch up on anything missed while disconnected
+                elif packet_type in ('2', '5') and payload and payload[0] in BLOCK_EVENTS:
+                    _new_block.set()
+    finally:
+        _connected = False
+        ws.close()
+
+
+def start_block_listener(url: str | None = None):
+    """
+    Start listening for new blocks in a background thread.
+    The listener reconnects with exponential backoff if the socket goes down.
+    """
+    global _listener_running
+    if _listener_running:
+        return
+    try:
+        import websocket  # noqa: F401
+    except ImportError:
+        print("websocket-client is not installed. Falling back to polling for new blocks.")
+        return
+    _listener_running = True
+    url = url or HSD_WS_URL
+
+    def run_listener():
+        retry_count = 0
+        while _listener_running:
+            started = time.time()
+            try:
+                _listen(url)
+            except Exception as e:
+                print(f"HSD socket error: {e}")
+            if not _listener_running:
+                break
+            if time.time() - started > 60:
+                retry_count = 0  # Connection was healthy for a while
+            wait_time = min(2 ** retry_count, 60)  # Exponential backoff, max 60 seconds
+            retry_count += 1
+            print(f"HSD socket disconnected, polling until reconnect in {wait_time} seconds...")
+            time.sleep(wait_time)
+
+    listener_thread = threading.Thread(target=run_listener, daemon=True)
+    listener_thread.start()
+    print("Started HSD block listener thread")
+
+
+def stop_block_listener():
+    """
+    Stop listening for new blocks.
+    """
+    global _listener_running
+    _listener_running = False
+
+
+def is_connected() -> bool:
+    """
+    Check if the block listener is currently subscribed to chain events.
+    """
+    return _connected
+
+
+def wait_for_block(timeout: float) -> bool:
+    """
+    Wait until a new block is announced or the timeout passes.
+    Without a socket connection this is the same as sleeping for the timeout.
+    Returns True if a block was announced.
+    """
+    announced = _new_block.wait(timeout)
+    _new_block.clear()
+    return announced
+
+
+# region Mock node
+# A stand-in for the HSD socket so the listener can be checked without a node:
+# python events.py --mock starts it locally and listens to it.
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def _ws_frame(text: str) -> bytes:
+    """
+    Encode an unmasked websocket text frame (servers never mask).
+    """
+    payload = text.encode()
+    if len(payload) < 126:
+        header = bytes([0x81, len(payload)])
+    elif len(payload) < 65536:
+        header = bytes([0x81, 126]) + len(payload).to_bytes(2, 'big')
+    else:
+        header = bytes([0x81, 127]) + len(payload).to_bytes(8, 'big')
+    return header + payload
+
+
+def _ws_read_frame(sock) -> tuple:
+    """
+    Read one masked websocket frame from a client.
+    Returns (opcode, payload).
+    """
+    def read(count: int) -> bytes:
+        data = b''
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError("Client disconnected")
+            data += chunk
+        return data
+
+    first, second = read(2)
+    length = second & 0x7f
+    if length == 126:
+        length = int.from_bytes(read(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(read(8), 'big')
+    mask = read(4) if second & 0x80 else b'\0\0\0\0'
+    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(read(length)))
+    return first & 0x0f, payload
+
+
+def serve_mock_node(host: str = '127.0.0.1', port: int = 0, block_interval: float = 5):
+    """
+    Start a mock HSD socket in a background thread that answers auth and watch chain
+    and announces a block connect to every watching client every block_interval seconds.
+    Returns the server, its address is server.server_address.
+    """
+    import base64
+    import hashlib
+    import select
+    import socketserver
+
+    class MockNodeHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            sock = self.request
+            request = b''
+            while b'\r\n\r\n' not in request:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+            headers = {}
+            for line in request.decode('latin-1').split('\r\n')[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            accept = base64.b64encode(hashlib.sha1((headers.get('sec-websocket-key', '') + _WS_GUID).encode()).digest())
+            sock.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+            sock.sendall(_ws_frame('0' + json.dumps({"sid": "mock", "pingInterval": 25000, "pingTimeout": 60000})))
+            sock.sendall(_ws_frame('40'))
+
+            height = 0
+            watching = False
+            next_block = time.time() + block_interval
+            while True:
+                ready, _, _ = select.select([sock], [], [], max(0, next_block - time.time()))
+                if not ready:
+                    if watching:
+                        height += 1
+                        sock.sendall(_ws_frame('42' + json.dumps(['block connect', f'{height:064x}', []])))
+                    next_block = time.time() + block_interval
+                    continue
+                try:
+                    opcode, payload = _ws_read_frame(sock)
+                except (ConnectionError, OSError):
+                    return
+                if opcode == 0x8:
+                    return  # Close
+                if opcode == 0x9:
+                    sock.sendall(bytes([0x8a, len(payload)]) + payload)  # Pong
+                    continue
+                message = payload.decode()
+                if message == '2':
+                    sock.sendall(_ws_frame('3'))
+                    continue
+                event = _parse_event(message)
+                if event is None or event[0] != '2' or event[1] is None:
+                    continue
+                _, ack_id, args = event
+                if args and args[0] == 'watch chain':
+                    watching = True
+                sock.sendall(_ws_frame(f'43{ack_id}' + json.dumps([None])))
+
+    server = socketserver.ThreadingTCPServer((host, port), MockNodeHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# endregion
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print new blocks announced on the HSD socket.")
+    parser.add_argument('--mock', action='store_true', help="Listen to a local mock node instead of HSD_WS_URL")
+    parser.add_argument('--interval', type=float, default=5, help="Seconds between mock blocks")
+    args = parser.parse_args()
+
+    url = None
+    if args.mock:
+        mock_host, mock_port = serve_mock_node(block_interval=args.interval).server_address
+        url = f'ws://{mock_host}:{mock_port}/socket.io/?transport=websocket'
+        print(f"Mock HSD socket listening on {url}")
+    start_block_listener(url)
+    try:
+        while True:
+            if wait_for_block(60):
+                print(f"New block announced (connected: {is_connected()})")
+    except KeyboardInterrupt:
+        stop_block_listener()
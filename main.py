@@ -5,8 +5,10 @@ from gunicorn.app.base import BaseApplication
 import os
 import dotenv
 import threading
-import time
 import domains
+import events
+import delivery
+import metrics
 from alerts import startTGBot, stopTGBot
 
 
@@ -26,18 +28,27 @@ class GunicornApp(BaseApplication):
 
 def run_expiry_checker():
     """
-    Background function to run notify_expiries every 2 minutes.
+    Background function to check for new blocks.
+    Checks as soon as the HSD socket announces a block (if HSD_EVENTS is enabled)
+    and falls back to checking every 2 minutes.
+    notify_expiries is only run for new blocks.
     """
+    if events.HSD_EVENTS:
+        events.start_block_listener()
+    try:
+        delivery.replay_outbox()
+    except Exception as e:
+        print(f"Error replaying alert outbox: {e}")
     while True:
         try:
-            print("Running expiry check...")
-            domains.notify_expiries()
-            print("Expiry check completed.")
+            processed = domains.check_new_blocks()
+            if processed:
+                print(f"Expiry check completed for {processed} new block(s).")
         except Exception as e:
             print(f"Error in expiry checker: {e}")
         
-        # Wait 2 minutes (120 seconds)
-        time.sleep(120)
+        # Wait for the next block or at most 2 minutes (120 seconds)
+        events.wait_for_block(120)
 
 def post_worker_init(worker):
     """
@@ -54,6 +65,7 @@ def post_worker_init(worker):
 
 if __name__ == '__main__':
     dotenv.load_dotenv()
+    metrics.clear()
     
     # Start the background expiry checker
     expiry_thread = threading.Thread(target=run_expiry_checker, daemon=True)
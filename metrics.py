@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import dotenv
+import storage
+
+dotenv.load_dotenv()
+
+# Every process (gunicorn workers and the process running the expiry checker) writes its metrics
+# to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds and /metrics adds them all up.
+METRICS_DIR = 'data/metrics'
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 15))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help)
+METRICS = {
+    'firealerts_scan_seconds': ('histogram', 'Time taken by notify_expiries for one block'),
+    'firealerts_scan_domains_total': ('counter', 'Domains looked at by notify_expiries'),
+    'firealerts_scan_last_domains': ('gauge', 'Domains looked at by the last notify_expiries run'),
+    'firealerts_alerts_fired_total': ('counter', 'Alerts fired by notify_expiries'),
+    'firealerts_hsd_request_seconds': ('histogram', 'Latency of requests to the HSD node'),
+    'firealerts_hsd_names_total': ('counter', 'Names looked up with getnameinfo'),
+    'firealerts_login_request_seconds': ('histogram', 'Latency of token validation requests to login.hns.au'),
+    'firealerts_auth_cache_total': ('counter', 'Token validations by auth cache result'),
+    'firealerts_alert_send_seconds': ('histogram', 'Time taken to send one alert message'),
+    'firealerts_alert_send_total': ('counter', 'Alert messages sent by result'),
+    'firealerts_store_seconds': ('histogram', 'Time taken by notification store reads and writes'),
+    'firealerts_alerts_sent_total': ('counter', 'Alerts delivered'),
+    'firealerts_alert_messages_total': ('counter', 'Messages alerts were delivered in'),
+    'firealerts_alerts_failed_total': ('counter', 'Alerts that could never be delivered'),
+    'firealerts_alerts_retried_total': ('counter', 'Alert delivery retries'),
+    'firealerts_alert_delivery_latency_seconds_total': ('counter', 'Total time from queueing to delivering alert messages'),
+    'firealerts_alert_delivery_latency_seconds_max': ('gauge', 'Longest time from queueing to delivering an alert message'),
+    'firealerts_alert_queue_depth': ('gauge', 'Alert messages waiting in the delivery queue'),
+    'firealerts_alerts_retrying': ('gauge', 'Alert messages waiting to be retried'),
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_gauges = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_collectors = []
+_flush_thread = None
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _reset_after_fork():
+    """
+    Start a forked process with empty metrics so the parent's values aren't counted twice.
+    """
+    global _lock, _counters, _gauges, _histograms, _flush_thread
+    _lock = threading.Lock()
+    _counters = {}
+    _gauges = {}
+    _histograms = {}
+    _flush_thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def inc(name: str, value: float = 1, **labels):
+    """
+    Increase a counter.
+    """
+    _start_flushing()
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """
+    Set a gauge to its current value.
+    """
+    _start_flushing()
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+
+
+def observe(name: str, value: float, **labels):
+    """
+    Record a value (usually seconds) in a histogram.
+    """
+    _start_flushing()
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bucket in enumerate(BUCKETS):
+            if value <= bucket:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Record how long a block (or, used as a decorator, a function) takes in a histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def register_collector(collector):
+    """
+    Add a function called on every flush that returns (type, name, labels, value) tuples,
+    for values that are already tracked elsewhere.
+    """
+    _collectors.append(collector)
+
+
+def _snapshot() -> dict:
+    counters = []
+    gauges = []
+    for collector in _collectors:
+        try:
+            for metric_type, name, labels, value in collector():
+                (counters if metric_type == 'counter' else gauges).append([name, labels, value])
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+    with _lock:
+        counters += [[name, dict(labels), value] for (name, labels), value in _counters.items()]
+        gauges += [[name, dict(labels), value] for (name, labels), value in _gauges.items()]
+        histograms = [[name, dict(labels), list(values)] for (name, labels), values in _histograms.items()]
+    return {"pid": os.getpid(), "counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+def flush():
+    """
+    Write this process's metrics to its file in METRICS_DIR.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    storage.write_json(os.path.join(METRICS_DIR, f'{os.getpid()}.json'), _snapshot())
+
+
+def _start_flushing():
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    with _lock:
+        if _flush_thread is not None:
+            return
+
+        def run_flush():
+            while True:
+                time.sleep(METRICS_FLUSH_INTERVAL)
+                try:
+                    flush()
+                except Exception as e:
+                    print(f"Error writing metrics: {e}")
+
+        _flush_thread = threading.Thread(target=run_flush, name="metrics-flush", daemon=True)
+        _flush_thread.start()
+
+
+def clear():
+    """
+    Remove the metrics files left by a previous run.
+    """
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        try:
+            os.remove(os.path.join(METRICS_DIR, filename))
+        except OSError:
+            pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = [
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    ]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render() -> str:
+    """
+    Add up the metrics of every process and format them for Prometheus.
+    Counters and histograms of exited processes are kept so totals never go backwards,
+    gauges are only taken from running processes.
+    """
+    try:
+        flush()
+    except Exception as e:
+        print(f"Error writing metrics: {e}")
+
+    counters = {}
+    gauges = {}
+    histograms = {}
+    filenames = os.listdir(METRICS_DIR) if os.path.isdir(METRICS_DIR) else []
+    for filename in filenames:
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename), 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot['counters']:
+            key = (name, _labels(labels))
+            counters[key] = counters.get(key, 0) + value
+        if _pid_alive(snapshot['pid']):
+            for name, labels, value in snapshot['gauges']:
+                key = (name, _labels(labels))
+                gauges[key] = gauges.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, _labels(labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+
+    samples = {}  # name -> lines
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, []).append(f'{name}{_format_labels(dict(labels))} {value}')
+    for (name, labels), value in gauges.items():
+        samples.setdefault(name, []).append(f'{name}{_format_labels(dict(labels))} {value}')
+    for (name, labels), values in histograms.items():
+        lines = samples.setdefault(name, [])
+        labels = dict(labels)
+        for bucket, count in zip(BUCKETS, values):
+            lines.append(f'{name}_bucket{_format_labels(dict(labels, le=bucket))} {count}')
+        lines.append(f'{name}_bucket{_format_labels(dict(labels, le="+Inf"))} {values[-1]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {values[-2]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+
+    output = []
+    for name in sorted(samples):
+        metric_type, description = METRICS.get(name, ('untyped', name))
+        output.append(f'# HELP {name} {description}')
+        output.append(f'# TYPE {name} {metric_type}')
+        output += samples[name]
+    return '\n'.join(output) + '\n'
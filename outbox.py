@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+import dotenv
+import storage
+
+dotenv.load_dotenv()
+
+# Alerts are appended here before they are sent and marked done once delivered
+OUTBOX_FILE = 'data/outbox.jsonl'
+# How long (seconds) delivered alert keys are remembered to drop duplicates
+OUTBOX_DONE_TTL = int(os.getenv('OUTBOX_DONE_TTL', 7 * 24 * 60 * 60))
+# Compact the log after this many alerts finished since the last compaction
+OUTBOX_COMPACT_AFTER = int(os.getenv('OUTBOX_COMPACT_AFTER', 1000))
+
+_lock = threading.RLock()
+_pending = None  # key -> record
+_finished = {}  # key -> time finished
+_finished_lines = 0  # Finished records appended since the last compaction
+
+
+def alert_key(notification: dict, trigger: int) -> str:
+    """
+    Get the idempotency key for an alert.
+    A notification fires at most once per trigger height.
+    """
+    return f"{notification['id']}:{trigger}"
+
+
+def _load():
+    """
+    Read the outbox log into memory.
+    """
+    global _pending, _finished_lines
+    if _pending is not None:
+        return
+    _pending = {}
+    _finished_lines = 0
+    if not os.path.exists(OUTBOX_FILE):
+        return
+    with open(OUTBOX_FILE, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Partial line from a crash mid-write
+            if record['status'] == 'pending':
+                if record['key'] not in _finished:
+                    _pending[record['key']] = record
+            else:
+                _pending.pop(record['key'], None)
+                _finished[record['key']] = record.get('at', time.time())
+                _finished_lines += 1
+
+
+def _append(records: list, sync: bool):
+    with storage.file_lock(OUTBOX_FILE):
+        with open(OUTBOX_FILE, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+
+def add(alerts: list) -> list:
+    """
+    Durably record alerts before they are sent.
+    alerts is a list of dicts with key, domain, notification and alert_data.
+    Returns the alerts that weren't already in the outbox.
+    """
+    with _lock:
+        _load()
+        new = []
+        for alert in alerts:
+            if alert['key'] in _pending or alert['key'] in _finished:
+                continue
+            record = dict(alert, status='pending', created=time.time())
+            _pending[alert['key']] = record
+            new.append(record)
+        if new:
+            _append(new, sync=True)
+        return new
+
+
+def _finish(key: str, status: str):
+    global _finished_lines
+    with _lock:
+        _load()
+        if _pending.pop(key, None) is None:
+            return
+        _finished[key] = time.time()
+        _finished_lines += 1
+        _append([{"key": key, "status": status, "at": _finished[key]}], sync=False)
+        if _finished_lines >= OUTBOX_COMPACT_AFTER:
+            compact()
+
+
+def mark_done(key: str):
+    """
+    Mark an alert as delivered.
+    """
+    _finish(key, 'done')
+
+
+def mark_failed(key: str):
+    """
+    Mark an alert as given up on so it isn't replayed.
+    """
+    _finish(key, 'failed')
+
+
+def pending() -> list:
+    """
+    Get every alert that was recorded but not delivered yet.
+    """
+    with _lock:
+        _load()
+        return list(_pending.values())
+
+
+def compact():
+    """
+    Rewrite the outbox log with only pending alerts and recently finished keys.
+    """
+    global _finished_lines
+    with _lock:
+        _load()
+        cutoff = time.time() - OUTBOX_DONE_TTL
+        for key in [key for key, at in _finished.items() if at < cutoff]:
+            del _finished[key]
+
+        with storage.file_lock(OUTBOX_FILE):
+            tmp_path = f'{OUTBOX_FILE}.tmp'
+            with open(tmp_path, 'w') as f:
+                for key, at in _finished.items():
+                    f.write(json.dumps({"key": key, "status": "done", "at": at}) + '\n')
+                for record in _pending.values():
+                    f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, OUTBOX_FILE)
+        _finished_lines = 0
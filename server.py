@@ -1,7 +1,13 @@
 from functools import cache
+import codecs
+import csv
+import hashlib
+import io
+import itertools
 import json
 from flask import (
     Flask,
+    Response,
     make_response,
     redirect,
     request,
@@ -17,7 +23,12 @@ from datetime import datetime
 import dotenv
 import threading
 import time
+from collections import OrderedDict
 import domains
+import sessions
+import events
+import delivery
+import metrics
 import atexit
 from alerts import NOTIFICATION_TYPES, startTGBot, stopTGBot, handle_alert
 
@@ -25,20 +36,79 @@ dotenv.load_dotenv()
 
 app = Flask(__name__)
 
+# Most domains that can be looked up in one /api/v1/domains request
+API_MAX_DOMAINS = int(os.getenv("API_MAX_DOMAINS", 1000))
+
+# Most notifications returned per page by /api/v1/notifications/<token>
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 1000))
+
+# Most notifications that can be added or deleted in one batch request
+API_MAX_BATCH_SIZE = int(os.getenv("API_MAX_BATCH_SIZE", 1000))
+
+# Token validation cache settings (seconds / entries)
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_NEGATIVE_CACHE_TTL = int(os.getenv("AUTH_NEGATIVE_CACHE_TTL", 10))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 1024))
+
+_auth_cache = OrderedDict()  # token -> (expires at, user data or None)
+_auth_cache_lock = threading.Lock()
+
 def run_expiry_checker():
     """
-    Background function to run notify_expiries every 2 minutes.
+    Background function to check for new blocks.
+    Checks as soon as the HSD socket announces a block (if HSD_EVENTS is enabled)
+    and falls back to checking every 2 minutes.
+    notify_expiries is only run for new blocks.
     """
+    if events.HSD_EVENTS:
+        events.start_block_listener()
+    try:
+        delivery.replay_outbox()
+    except Exception as e:
+        print(f"Error replaying alert outbox: {e}")
     while True:
         try:
-            print("Running expiry check...")
-            domains.notify_expiries()
-            print("Expiry check completed.")
+            processed = domains.check_new_blocks()
+            if processed:
+                print(f"Expiry check completed for {processed} new block(s).")
         except Exception as e:
             print(f"Error in expiry checker: {e}")
         
-        # Wait 2 minutes (120 seconds)
-        time.sleep(120)
+        # Wait for the next block or at most 2 minutes (120 seconds)
+        events.wait_for_block(120)
+
+def get_user(token: str) -> dict | None:
+    """
+    Get the login.hns.au user for a token, or None if the token is invalid.
+    Results are cached for AUTH_CACHE_TTL seconds and rejected tokens for AUTH_NEGATIVE_CACHE_TTL seconds.
+    """
+    now = time.time()
+    with _auth_cache_lock:
+        cached = _auth_cache.get(token)
+        if cached and cached[0] > now:
+            _auth_cache.move_to_end(token)
+            metrics.inc("firealerts_auth_cache_total", result="hit")
+            return cached[1]
+
+    metrics.inc("firealerts_auth_cache_total", result="miss")
+    with metrics.timed("firealerts_login_request_seconds"):
+        user_data = sessions.login().get("https://login.hns.au/auth/user", params={"token": token})
+    if user_data.status_code == 200:
+        user = user_data.json()
+        ttl = AUTH_CACHE_TTL
+    elif 400 <= user_data.status_code < 500:
+        user = None
+        ttl = AUTH_NEGATIVE_CACHE_TTL
+    else:
+        # Don't cache login service errors
+        return None
+
+    with _auth_cache_lock:
+        _auth_cache[token] = (now + ttl, user)
+        _auth_cache.move_to_end(token)
+        while len(_auth_cache) > AUTH_CACHE_SIZE:
+            _auth_cache.popitem(last=False)
+    return user
 
 def find(name, path):
     for root, dirs, files in os.walk(path):
@@ -104,10 +174,9 @@ def account():
     if not token:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
     
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
-    if user_data.status_code != 200:
+    user_data = get_user(token)
+    if not user_data:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
-    user_data = user_data.json()
 
     notifications = domains.get_account_notifications(user_data["username"])
     if not notifications:
@@ -129,6 +198,12 @@ def login():
 
 @app.route("/logout")
 def logout():
+    # Forget the cached user for this token
+    token = request.cookies.get("token")
+    if token:
+        with _auth_cache_lock:
+            _auth_cache.pop(token, None)
+
     # Clear the token cookie
     response = make_response(redirect(f"{request.host_url}"))
     response.set_cookie("token", "", expires=0, httponly=True, secure=True)
@@ -139,15 +214,15 @@ def logout():
 def bulk_upload_notifications():
     """
     Bulk upload notifications from a CSV file.
+    Valid rows are saved in a single write, invalid rows are reported back with their row number.
     """
     token = request.cookies.get("token")
     if not token:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
     
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
-    if user_data.status_code != 200:
+    user_data = get_user(token)
+    if not user_data:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
-    user_data = user_data.json()
     
     username = user_data.get("username", None)
     if not username:
@@ -161,69 +236,94 @@ def bulk_upload_notifications():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
     
-    # Read the CSV file
+    # Stream the CSV file row by row and commit every valid row in one write
+    additions = []
+    errors = []
     try:
-        content = file.read().decode('utf-8')
-        lines = content.splitlines()
-        for line in lines:
-            parts = line.split(',')
-            if len(parts) < 3:
-                continue  # Skip invalid lines
-            
-            domain = parts[0].strip()
-            blocks = parts[1].strip()
+        reader = csv.reader(codecs.iterdecode(file.stream, 'utf-8-sig'))
+        for row_number, row in enumerate(reader, start=1):
+            if not any(column.strip() for column in row):
+                continue  # Skip blank lines
             try:
-                blocks = int(blocks)
-                if blocks <= 0:
-                    return jsonify({"error": "Blocks must be a positive integer"}), 400
-            except ValueError:
-                return jsonify({"error": "Invalid blocks value"}), 400
-
-            notification_type = parts[2].strip().lower() # Normalize to lowercase
-
-            # Find the notification type
-            notificationType = None
-            for notification in NOTIFICATION_TYPES:
-                if notification['type'] == notification_type:
-                    notificationType = notification
-                    break
-            else:
-                return jsonify({"error": f"Invalid notification type: {notification_type}"}), 400
-                continue  # Skip invalid notification types
-            
-
-            # Create the notification data
-            notification_data = {
-                'domain': domain,
-                'blocks': blocks,
-                'type': notification_type,
-                'user_name': username,
-                'id': os.urandom(16).hex()  # Generate a random ID for the notification
-            }
-            
-            arg = 3
-            # Add additional fields based on the notification type
-            for field in notificationType['fields']:
-                if field['name'] not in notification_data and field.get('required', False):
-                    # Try to read the field from the line
-                    if len(parts) > arg:
-                        field_value = parts[arg].strip()
-                        if field_value:
-                            notification_data[field['name']] = field_value
-                        else:
-                            return jsonify({"error": f"Missing required field: {field['name']}"}), 400
-                    else:
-                        # Auto fill default values for username
-                        if field['type'] == 'username':
-                            notification_data[field['name']] = username
-                        else:
-                            return jsonify({"error": f"Missing required field: {field['name']}"}), 400
-            print(notification_data)
-            domains.add_notification(domain, notification_data)
-        
-        return redirect(f"{request.host_url}account")
+                additions.append(parse_bulk_row(row, username))
+            except ValueError as e:
+                errors.append({"row": row_number, "error": str(e)})
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Failed to process file: {str(e)}"}), 400
+
+    try:
+        domains.add_notifications(additions)
     except Exception as e:
-        return jsonify({"error": f"Failed to process file: {str(e)}"}), 500
+        return jsonify({"error": f"Failed to save notifications: {str(e)}"}), 500
+
+    if errors:
+        return jsonify({"added": len(additions), "errors": errors}), 200 if additions else 400
+    return redirect(f"{request.host_url}account")
+
+def parse_bulk_row(row: list, username: str) -> tuple:
+    """
+    Parse a bulk upload CSV row into a (domain, notification) pair.
+    Rows are domain, blocks, type followed by the fields for that type in order.
+    Raises ValueError if the row is invalid.
+    """
+    parts = [part.strip() for part in row]
+    if len(parts) < 3:
+        raise ValueError("Expected at least domain, blocks and type")
+
+    domain = parts[0]
+    if not domain:
+        raise ValueError("Missing domain")
+    try:
+        blocks = int(parts[1])
+    except ValueError:
+        raise ValueError(f"Invalid blocks value: {parts[1]}")
+    if blocks <= 0:
+        raise ValueError("Blocks must be a positive integer")
+
+    notification_type = parts[2].lower() # Normalize to lowercase
+    for notificationType in NOTIFICATION_TYPES:
+        if notificationType['type'] == notification_type:
+            break
+    else:
+        raise ValueError(f"Invalid notification type: {notification_type}")
+
+    notification_data = {
+        'blocks': blocks,
+        'type': notification_type,
+        'user_name': username,
+        'id': os.urandom(16).hex()  # Generate a random ID for the notification
+    }
+
+    # Additional fields follow in the order the notification type lists them
+    values = parts[3:]
+    for i, field in enumerate(notificationType['fields']):
+        field_value = values[i] if i < len(values) else ''
+        if field_value:
+            notification_data[field['name']] = field_value
+        elif field['type'] == 'username':
+            # Auto fill default values for username
+            notification_data[field['name']] = username
+        elif field.get('required', False):
+            raise ValueError(f"Missing required field: {field['name']}")
+    return domain, notification_data
+
+@app.route("/bulk_download")
+def bulk_download_notifications():
+    """
+    Download all notifications as a CSV file in the bulk upload format.
+    """
+    token = request.cookies.get("token")
+    if not token:
+        return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
+
+    user_data = get_user(token)
+    if not user_data:
+        return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
+
+    notifications = domains.iter_account_notifications(user_data["username"])
+    response = Response(csv_lines(notifications), mimetype="text/csv")
+    response.headers["Content-Disposition"] = "attachment; filename=notifications.csv"
+    return response
 
 @app.route("/notification/<notificationtype>", methods=["POST"])
 def addNotification(notificationtype: str):
@@ -235,10 +335,9 @@ def addNotification(notificationtype: str):
     if not token:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
     
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
-    if user_data.status_code != 200:
+    user_data = get_user(token)
+    if not user_data:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
-    user_data = user_data.json()
     username = user_data.get("username", None)
     if not username:
         return jsonify({"error": "Invalid user data"}), 400
@@ -292,10 +391,9 @@ def delete_notification(notification_id: str):
     if not token:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
     
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
-    if user_data.status_code != 200:
+    user_data = get_user(token)
+    if not user_data:
         return redirect(f"https://login.hns.au/auth?return={request.host_url}login")
-    user_data = user_data.json()
     
     domains.delete_notification(notification_id, user_data['username'])
     return redirect(f"{request.host_url}account")
@@ -345,89 +443,292 @@ def catch_all(path: str):
 # endregion
 
 # region API routes
+def is_not_modified(etag: str) -> bool:
+    """
+    Check if the client already has the version of a response identified by etag.
+    """
+    return request.if_none_match.contains(etag)
+
+def not_modified_response(etag: str):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
 @app.route("/api/v1/domain/<domain>")
 def api_get_domain(domain: str):
     """
     Get the expiry date of a domain.
+    Responses carry an ETag for the current block so unchanged polls get a 304.
     """
-    expiry_date = domains.get_domain_expiry_block(domain)
-    current_block = domains.get_current_block()
+    current_block = domains.get_cached_current_block()
+    # The domain is user input, hash it so the ETag is always a valid header value
+    etag = f"domain-{hashlib.sha1(domain.encode()).hexdigest()[:12]}-{current_block}"
+    if current_block != -1 and is_not_modified(etag):
+        return not_modified_response(etag)
+
+    expiry_date = domains.get_cached_expiry_block(domain, current_block, persist=False)
     expires_in_blocks = expiry_date - current_block if expiry_date != -1 else -1
     
-    return jsonify({"domain": domain, "expiry_date": expiry_date, "expires_in_blocks": expires_in_blocks})
+    response = jsonify({"domain": domain, "expiry_date": expiry_date, "expires_in_blocks": expires_in_blocks})
+    if current_block != -1 and expiry_date != -1:
+        # Failed lookups aren't tagged so the client retries them
+        response.set_etag(etag)
+    return response
+
+@app.route("/api/v1/domains", methods=["GET", "POST"])
+def api_get_domains():
+    """
+    Get the expiry dates of many domains at once.
+    Domains are passed as a JSON array (POST) or a comma separated domains parameter (GET).
+    """
+    if request.method == "POST":
+        domain_list = request.get_json(silent=True)
+    else:
+        domain_list = [domain for domain in request.args.get("domains", "").split(",") if domain.strip()]
+    if not isinstance(domain_list, list) or not domain_list:
+        return jsonify({"error": "Expected a list of domains"}), 400
+    if len(domain_list) > API_MAX_DOMAINS:
+        return jsonify({"error": f"At most {API_MAX_DOMAINS} domains can be looked up at once"}), 400
+
+    names = [domain.strip() for domain in domain_list if isinstance(domain, str) and domain.strip()]
+    current_block = domains.get_cached_current_block()
+    expiry_blocks = domains.get_cached_expiry_blocks(names, current_block, persist=False) if names else {}
+
+    results = []
+    for domain in domain_list:
+        if not isinstance(domain, str) or not domain.strip():
+            results.append({"domain": domain, "expiry_date": -1, "expires_in_blocks": -1, "error": "Invalid domain"})
+            continue
+        domain = domain.strip()
+        expiry_date = expiry_blocks.get(domain, -1)
+        if expiry_date == -1:
+            results.append({"domain": domain, "expiry_date": -1, "expires_in_blocks": -1,
+                            "error": "Domain not found or lookup failed"})
+            continue
+        expires_in_blocks = expiry_date - current_block if current_block != -1 else -1
+        results.append({"domain": domain, "expiry_date": expiry_date, "expires_in_blocks": expires_in_blocks, "error": None})
+
+    return jsonify({"current_block": current_block, "domains": results})
 
 @app.route("/api/v1/current_block")
 def api_get_current_block():
     """
     Get the current block number.
     """
-    current_block = domains.get_current_block()
+    current_block = domains.get_cached_current_block()
     
     return jsonify({"current_block": current_block})
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Get metrics for every worker and the expiry checker in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/api/v1/notifications/<token>")
 def api_get_notifications(token: str):
     """
     Get all notifications for a user.
+    Pass limit (and the returned next_cursor as cursor) to page through them,
+    or format=ndjson / format=csv to stream them.
+    Responses carry an ETag for the user's change counter so unchanged polls get a 304.
     """
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
-    if user_data.status_code != 200:
+    user_data = get_user(token)
+    if not user_data:
         return jsonify({"error": "Invalid token"}), 401
-    user_data = user_data.json()
-    
-    notifications = domains.get_account_notifications(user_data["username"])
-    
-    return jsonify(notifications)
+
+    etag = f"notifications-{domains.get_user_version(user_data['username'])}"
+    if request.query_string:
+        # Each page and format is a different response
+        etag += "-" + hashlib.sha1(request.query_string).hexdigest()[:12]
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
+    output_format = request.args.get("format", "json")
+    if output_format not in ("json", "ndjson", "csv"):
+        return jsonify({"error": "Invalid format"}), 400
+    limit = request.args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({"error": "Invalid limit value"}), 400
+        if limit <= 0 or limit > API_MAX_PAGE_SIZE:
+            return jsonify({"error": f"Limit must be between 1 and {API_MAX_PAGE_SIZE}"}), 400
+
+    notifications = domains.iter_account_notifications(user_data["username"], request.args.get("cursor"))
+
+    next_cursor = None
+    if limit is not None:
+        page = list(itertools.islice(notifications, limit + 1))
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = page[-1]['notification']['id']
+        notifications = page
+
+    if output_format == "ndjson":
+        response = Response(ndjson_lines(notifications), mimetype="application/x-ndjson")
+    elif output_format == "csv":
+        response = Response(csv_lines(notifications), mimetype="text/csv")
+        response.headers["Content-Disposition"] = "attachment; filename=notifications.csv"
+    elif limit is not None:
+        response = jsonify({"notifications": notifications, "next_cursor": next_cursor})
+    else:
+        response = jsonify(list(notifications))
+
+    if next_cursor and output_format != "json":
+        response.headers["X-Next-Cursor"] = next_cursor
+    response.set_etag(etag)
+    return response
+
+def ndjson_lines(notifications):
+    """
+    Stream notifications as newline delimited JSON.
+    """
+    for notification in notifications:
+        yield json.dumps(notification) + "\n"
+
+def csv_lines(notifications):
+    """
+    Stream notifications as CSV rows in the /bulk_upload format.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for notification in notifications:
+        writer.writerow(bulk_row(notification['domain'], notification['notification']))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def bulk_row(domain: str, notification: dict) -> list:
+    """
+    Turn a notification into a /bulk_upload CSV row.
+    """
+    row = [domain, notification.get('blocks', ''), notification.get('type', '')]
+    for notificationType in NOTIFICATION_TYPES:
+        if notificationType['type'] == notification.get('type'):
+            row += [notification.get(field['name'], '') for field in notificationType['fields']]
+            break
+    while row and row[-1] == '':
+        row.pop()
+    return row
 
 @app.route("/api/v1/notifications/<token>", methods=["POST"])
 def api_add_notification(token: str):
     """
     Add a notification for a user.
     """
-    user_data = requests.get(f"https://login.hns.au/auth/user?token={token}")
-    if user_data.status_code != 200:
+    user_data = get_user(token)
+    if not user_data:
         return jsonify({"error": "Invalid token"}), 401
-    user_data = user_data.json()
     
     username = user_data.get("username", None)
     if not username:
         return jsonify({"error": "Invalid user data"}), 400
 
     data = request.json
-    if not data or 'domain' not in data or 'blocks' not in data or 'type' not in data:
-        return jsonify({"error": "Invalid request data"}), 400
-    
-    domain = data['domain']
-    
+    try:
+        domain, notification = build_notification(data, username)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    domains.add_notification(domain, notification)
+    return jsonify({"message": "Notification added successfully", "notification": notification}), 201
+
+@app.route("/api/v1/notifications/<token>/batch", methods=["POST"])
+def api_add_notifications(token: str):
+    """
+    Add many notifications for a user in a single write.
+    Takes a JSON array of notifications (in the same format as adding one) and returns a result for each.
+    """
+    user_data = get_user(token)
+    if not user_data:
+        return jsonify({"error": "Invalid token"}), 401
+
+    username = user_data.get("username", None)
+    if not username:
+        return jsonify({"error": "Invalid user data"}), 400
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({"error": "Request body must be a list of notifications"}), 400
+    if len(data) > API_MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {API_MAX_BATCH_SIZE} notifications can be added at once"}), 400
+
+    additions = []
+    results = []
+    for data_item in data:
+        try:
+            domain, notification = build_notification(data_item, username)
+        except ValueError as e:
+            results.append({"error": str(e)})
+            continue
+        additions.append((domain, notification))
+        results.append({"domain": domain, "notification": notification})
+
+    domains.add_notifications(additions)
+    return jsonify({"added": len(additions), "failed": len(data) - len(additions), "results": results})
+
+@app.route("/api/v1/notifications/<token>/batch_delete", methods=["POST"])
+def api_delete_notifications(token: str):
+    """
+    Delete many notifications for a user in a single write.
+    Takes a JSON array of notification ids and returns a result for each.
+    """
+    user_data = get_user(token)
+    if not user_data:
+        return jsonify({"error": "Invalid token"}), 401
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list) or not all(isinstance(notification_id, str) for notification_id in data):
+        return jsonify({"error": "Request body must be a list of notification ids"}), 400
+    if len(data) > API_MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {API_MAX_BATCH_SIZE} notifications can be deleted at once"}), 400
+
+    deleted = set(domains.delete_notifications(data, user_data['username']))
+    results = [
+        {"id": notification_id, "deleted": True} if notification_id in deleted
+        else {"id": notification_id, "deleted": False, "error": "Notification not found"}
+        for notification_id in data
+    ]
+    return jsonify({"deleted": len(deleted), "results": results})
+
+def build_notification(data, username: str) -> tuple:
+    """
+    Validate a notification from the JSON API and turn it into a (domain, notification) pair.
+    Raises ValueError if the notification is invalid.
+    """
+    if not isinstance(data, dict) or 'domain' not in data or 'blocks' not in data or 'type' not in data:
+        raise ValueError("Invalid request data")
+    if not isinstance(data['domain'], str) or not data['domain']:
+        raise ValueError("Invalid domain")
+
     notificationtype = data['type']
-    notificationType = None
-    for notification in NOTIFICATION_TYPES:
-        if notification['type'] == notificationtype:
-            notificationType = notification
+    for notificationType in NOTIFICATION_TYPES:
+        if notificationType['type'] == notificationtype:
             break
     else:
-        return jsonify({"error": "Invalid notification type"}), 400
-    
+        raise ValueError("Invalid notification type")
+
     for field in notificationType['fields']:
         if field['name'] not in data and field.get('required', False):
-            return jsonify({"error": f"Missing field: {field['name']}"}), 400
+            raise ValueError(f"Missing field: {field['name']}")
     # Validate blocks
     try:
         blocks = int(data['blocks'])
-        if blocks <= 0:
-            return jsonify({"error": "Blocks must be a positive integer"}), 400
-    except ValueError:
-        return jsonify({"error": "Invalid blocks value"}), 400
-    
-    notification = data
+    except (TypeError, ValueError):
+        raise ValueError("Invalid blocks value")
+    if blocks <= 0:
+        raise ValueError("Blocks must be a positive integer")
+
+    notification = dict(data)
     notification['blocks'] = blocks
     notification['type'] = notificationtype
     notification['id'] = os.urandom(16).hex()  # Generate a random ID for the notification
     notification['user_name'] = username
     # Delete domain duplicate from data
-    notification.pop('domain', None)
-    domains.add_notification(domain, notification)
-    return jsonify({"message": "Notification added successfully", "notification": notification}), 201
+    domain = notification.pop('domain')
+    return domain, notification
 
 # endregion
 
@@ -440,6 +741,8 @@ def not_found(e):
 
 # endregion
 if __name__ == "__main__":
+    metrics.clear()
+
     # Start the background expiry checker for development mode
     expiry_thread = threading.Thread(target=run_expiry_checker, daemon=True)
     expiry_thread.start()
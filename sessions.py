@@ -0,0 +1,72 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import dotenv
+
+dotenv.load_dotenv()
+
+# Connection pool sizes and timeouts (seconds) for each remote service
+HSD_POOL_SIZE = int(os.getenv('HSD_POOL_SIZE', 10))
+HSD_TIMEOUT = float(os.getenv('HSD_TIMEOUT', 30))
+DISCORD_POOL_SIZE = int(os.getenv('DISCORD_POOL_SIZE', 10))
+DISCORD_TIMEOUT = float(os.getenv('DISCORD_TIMEOUT', 10))
+LOGIN_POOL_SIZE = int(os.getenv('LOGIN_POOL_SIZE', 10))
+LOGIN_TIMEOUT = float(os.getenv('LOGIN_TIMEOUT', 10))
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session with a default timeout for every request.
+    """
+
+    def __init__(self, timeout: float, pool_size: int):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _get_session(name: str, timeout: float, pool_size: int) -> TimeoutSession:
+    """
+    Get the shared session for a service.
+    Sessions are recreated after a fork so workers never share sockets with the master process.
+    """
+    global _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        if name not in _sessions:
+            _sessions[name] = TimeoutSession(timeout, pool_size)
+        return _sessions[name]
+
+
+def hsd() -> TimeoutSession:
+    """
+    Get the keep-alive session for the HSD node RPC.
+    """
+    return _get_session('hsd', HSD_TIMEOUT, HSD_POOL_SIZE)
+
+
+def discord() -> TimeoutSession:
+    """
+    Get the keep-alive session for Discord webhooks.
+    """
+    return _get_session('discord', DISCORD_TIMEOUT, DISCORD_POOL_SIZE)
+
+
+def login() -> TimeoutSession:
+    """
+    Get the keep-alive session for login.hns.au.
+    """
+    return _get_session('login', LOGIN_TIMEOUT, LOGIN_POOL_SIZE)
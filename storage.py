@@ -0,0 +1,695 @@
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+import dotenv
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+dotenv.load_dotenv()
+
+# Notification storage backend, either "json" (data/domains.json) or "sqlite" (data/domains.db)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+JSON_FILE = 'data/domains.json'
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'data/domains.db')
+
+# How much change history is kept so other processes can catch up without reloading the whole store
+JSON_CHANGES_MAX_SIZE = 1024 * 1024  # bytes of data/domains_changes.jsonl
+SQLITE_CHANGES_KEEP = 1000  # versions
+MEMORY_CHANGES_KEEP = 10000  # notifications
+
+
+_held_locks = threading.local()
+_memory_stores = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    """
+    Give a forked process fresh locks and in-memory copies.
+    The parent's threads may have held a lock at the moment of the fork, and it would never be released in the child.
+    """
+    global _held_locks
+    _held_locks = threading.local()
+    for store in list(_memory_stores):
+        store._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock on path (through a separate .lock file) across processes and threads.
+    The lock is re-entrant within a thread.
+    """
+    held = _held_locks.__dict__.setdefault('paths', set())
+    if path in held:
+        yield
+        return
+
+    with open(f'{path}.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        held.add(path)
+        try:
+            yield
+        finally:
+            held.discard(path)
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_json(path: str, data, indent: int | None = None, mtime_ns: int | None = None):
+    """
+    Atomically write JSON to path by writing a temporary file and renaming it over path.
+    Readers see either the old or the new file, never a half-written one.
+    mtime_ns sets the modification time of the new file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        if mtime_ns is not None:
+            os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JSONStorage:
+    """
+    Store all notifications in a single JSON file.
+    Every write rewrites the whole file so this is best suited to small installs.
+    Each write is also appended to a changes log so other processes can apply it without rereading the file.
+    """
+
+    def __init__(self, path: str = JSON_FILE):
+        self.path = path
+        self.changes_path = f'{os.path.splitext(path)[0]}_changes.jsonl'
+        with self.lock():
+            if not os.path.exists(self.path):
+                write_json(self.path, {})
+
+    def _write(self, domains: dict, changes: list):
+        """
+        Write the store and log the changes made to it.
+        Every write gets a later modification time than the last, and the change is logged under it before
+        the file is replaced, so a reader that sees the new file can always find how it got there.
+        """
+        before = self.version()[0]
+        after = max(time.time_ns(), before + 1)
+        entry = json.dumps({'before': before, 'after': after, 'changes': changes}) + '\n'
+        mode = 'a'
+        if os.path.exists(self.changes_path) and os.path.getsize(self.changes_path) > JSON_CHANGES_MAX_SIZE:
+            mode = 'w'
+        with open(self.changes_path, mode) as f:
+            f.write(entry)
+        write_json(self.path, domains, indent=4, mtime_ns=after)
+
+    def lock(self):
+        """
+        Lock the store against writes from other processes.
+        """
+        return file_lock(self.path)
+
+    def version(self):
+        """
+        Get a value that changes whenever the store is written to.
+        """
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def changes_since(self, version, until) -> list | None:
+        """
+        Get the changes that took the store from version to until as ['put', domain, notification]
+        and ['delete', domain, {'id', 'user_name'}] entries, or None if they are no longer logged.
+        """
+        entries = {}
+        try:
+            with open(self.changes_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:  # Being appended right now
+                        continue
+                    # A write that failed after logging is followed by a retry from the same version
+                    entries[entry['before']] = entry
+        except FileNotFoundError:
+            return None
+
+        changes = []
+        current = version[0]
+        while current != until[0]:
+            entry = entries.get(current)
+            if entry is None:
+                return None
+            changes.extend(entry['changes'])
+            current = entry['after']
+        return changes
+
+    def get_domains(self) -> dict:
+        with open(self.path, 'r') as f:
+            domains = json.load(f)
+        return domains
+
+    def add_notification(self, domain: str, notification: dict):
+        with self.lock():
+            domains = self.get_domains()
+            if domain not in domains:
+                domains[domain] = []
+            domains[domain].append(notification)
+            self._write(domains, [['put', domain, notification]])
+
+    def add_notifications(self, additions: list):
+        """
+        Add many (domain, notification) pairs with a single write.
+        """
+        with self.lock():
+            domains = self.get_domains()
+            for domain, notification in additions:
+                domains.setdefault(domain, []).append(notification)
+            self._write(domains, [['put', domain, notification] for domain, notification in additions])
+
+    def update_notification(self, domain: str, notification: dict):
+        self.update_notifications([(domain, notification)])
+
+    def update_notifications(self, updates: list):
+        """
+        Update many (domain, notification) pairs with a single write.
+        """
+        with self.lock():
+            domains = self.get_domains()
+            for domain, notification in updates:
+                for i, existing_notification in enumerate(domains.setdefault(domain, [])):
+                    if existing_notification['type'] == notification['type'] and existing_notification['id'] == notification['id']:
+                        domains[domain][i] = notification
+                        break
+                else:
+                    domains[domain].append(notification)
+            self._write(domains, [['put', domain, notification] for domain, notification in updates])
+
+    def delete_notification(self, notification_id: str, user_name: str) -> list:
+        """
+        Delete a notification and return the domains it was removed from.
+        """
+        with self.lock():
+            domains = self.get_domains()
+            domains_to_delete = []
+            domains_changed = []
+
+            for domain in domains:
+                remaining = [n for n in domains[domain] if n['id'] != notification_id or n.get('user_name') != user_name]
+                if len(remaining) != len(domains[domain]):
+                    domains_changed.append(domain)
+                domains[domain] = remaining
+                if not domains[domain]:
+                    domains_to_delete.append(domain)
+
+            # Remove empty domains after iteration
+            for domain in domains_to_delete:
+                del domains[domain]
+
+            if domains_changed:
+                self._write(domains, [['delete', domain, {'id': notification_id, 'user_name': user_name}]
+                                      for domain in domains_changed])
+        return domains_changed
+
+    def delete_notifications(self, notification_ids: list, user_name: str) -> dict:
+        """
+        Delete many notifications with a single write.
+        Returns a dict of notification id -> domains it was removed from, for the ids that were found.
+        """
+        notification_ids = set(notification_ids)
+        with self.lock():
+            domains = self.get_domains()
+            deleted = {}
+            for domain in list(domains):
+                remaining = []
+                for n in domains[domain]:
+                    if n['id'] in notification_ids and n.get('user_name') == user_name:
+                        deleted.setdefault(n['id'], []).append(domain)
+                    else:
+                        remaining.append(n)
+                if remaining:
+                    domains[domain] = remaining
+                else:
+                    del domains[domain]
+            if deleted:
+                self._write(domains, [['delete', domain, {'id': notification_id, 'user_name': user_name}]
+                                      for notification_id, domains_changed in deleted.items()
+                                      for domain in domains_changed])
+        return deleted
+
+    def get_account_notifications(self, user_name: str) -> list:
+        domains = self.get_domains()
+        # For each notification check if user_name
+        notifications = []
+        for domain, domain_notifications in domains.items():
+            for notification in domain_notifications:
+                if notification.get('user_name') == user_name:
+                    notifications.append({
+                        'domain': domain,
+                        'notification': notification
+                    })
+        return notifications
+
+
+class SQLiteStorage:
+    """
+    Store notifications in SQLite (WAL mode) with one row per notification.
+    Each write is also recorded in the changes table so other processes can apply it without rereading the table.
+    """
+
+    def __init__(self, path: str = SQLITE_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notifications (
+                    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    domain TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    user_name TEXT,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_key ON notifications (domain, id, type)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_domain ON notifications (domain)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_id ON notifications (id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_name)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS changes (
+                    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    version INTEGER NOT NULL,
+                    op TEXT NOT NULL,
+                    domain TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_version ON changes (version)")
+            # Oldest version the changes table can bring up to date
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'changes_from', value FROM meta WHERE key = 'version'")
+        self._migrate_json()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the SQLite connection for the current thread.
+        A forked process opens its own connections, SQLite connections can't be shared across a fork.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def lock(self):
+        """
+        Lock the store against writes from other processes.
+        SQLite serialises writes itself, this is only used to keep MemoryStorage in step.
+        """
+        return file_lock(self.path)
+
+    def _bump_version(self, conn: sqlite3.Connection, changes: list | None = None):
+        """
+        Bump the store version and record the changes made in this transaction.
+        Without changes earlier versions can't be brought up to date and have to reload.
+        """
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        if changes is None:
+            conn.execute("DELETE FROM changes")
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'changes_from'", (version,))
+            return
+        conn.executemany("INSERT INTO changes (version, op, domain, data) VALUES (?, ?, ?, ?)",
+                         [(version, op, domain, json.dumps(data)) for op, domain, data in changes])
+        if version % 100 == 0 and version > SQLITE_CHANGES_KEEP:
+            conn.execute("DELETE FROM changes WHERE version <= ?", (version - SQLITE_CHANGES_KEEP,))
+            conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'changes_from'", (version - SQLITE_CHANGES_KEEP,))
+
+    def _migrate_json(self):
+        """
+        Import data/domains.json the first time the SQLite backend is used.
+        """
+        with self._connection() as conn:
+            migrated = conn.execute("SELECT value FROM meta WHERE key = 'migrated_json'").fetchone()
+            if migrated or not os.path.exists(JSON_FILE):
+                return
+            with open(JSON_FILE, 'r') as f:
+                domains = json.load(f)
+            rows = [
+                (domain, n['id'], n['type'], n.get('user_name'), json.dumps(n))
+                for domain, notifications in domains.items()
+                for n in notifications
+            ]
+            conn.executemany(
+                "INSERT OR REPLACE INTO notifications (domain, id, type, user_name, data) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', 1)")
+            self._bump_version(conn)
+        print(f"Migrated {len(rows)} notifications from {JSON_FILE} to {self.path}")
+
+    def version(self):
+        """
+        Get a value that changes whenever the store is written to.
+        """
+        return self._connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def changes_since(self, version, until) -> list | None:
+        """
+        Get the changes that took the store from version to until as ['put', domain, notification]
+        and ['delete', domain, {'id', 'user_name'}] entries, or None if they are no longer recorded.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            changes_from = conn.execute("SELECT value FROM meta WHERE key = 'changes_from'").fetchone()[0]
+            if version < changes_from:
+                return None
+            return [[op, domain, json.loads(data)] for op, domain, data in conn.execute(
+                "SELECT op, domain, data FROM changes WHERE version > ? AND version <= ? ORDER BY row_id", (version, until))]
+        finally:
+            conn.commit()
+
+    def get_domains(self) -> dict:
+        domains = {}
+        for domain, data in self._connection().execute("SELECT domain, data FROM notifications ORDER BY row_id"):
+            domains.setdefault(domain, []).append(json.loads(data))
+        return domains
+
+    def add_notification(self, domain: str, notification: dict):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO notifications (domain, id, type, user_name, data) VALUES (?, ?, ?, ?, ?)",
+                (domain, notification['id'], notification['type'], notification.get('user_name'), json.dumps(notification)))
+            self._bump_version(conn, [['put', domain, notification]])
+
+    def add_notifications(self, additions: list):
+        """
+        Add many (domain, notification) pairs in a single transaction.
+        """
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO notifications (domain, id, type, user_name, data) VALUES (?, ?, ?, ?, ?)",
+                [(domain, n['id'], n['type'], n.get('user_name'), json.dumps(n)) for domain, n in additions])
+            self._bump_version(conn, [['put', domain, n] for domain, n in additions])
+
+    def update_notification(self, domain: str, notification: dict):
+        self.update_notifications([(domain, notification)])
+
+    def update_notifications(self, updates: list):
+        """
+        Update many (domain, notification) pairs in a single transaction.
+        """
+        with self._connection() as conn:
+            for domain, notification in updates:
+                cursor = conn.execute(
+                    "UPDATE notifications SET user_name = ?, data = ? WHERE domain = ? AND id = ? AND type = ?",
+                    (notification.get('user_name'), json.dumps(notification), domain, notification['id'], notification['type']))
+                if cursor.rowcount == 0:
+                    conn.execute(
+                        "INSERT INTO notifications (domain, id, type, user_name, data) VALUES (?, ?, ?, ?, ?)",
+                        (domain, notification['id'], notification['type'], notification.get('user_name'), json.dumps(notification)))
+            self._bump_version(conn, [['put', domain, notification] for domain, notification in updates])
+
+    def delete_notification(self, notification_id: str, user_name: str) -> list:
+        """
+        Delete a notification and return the domains it was removed from.
+        """
+        with self._connection() as conn:
+            domains_changed = [row[0] for row in conn.execute(
+                "SELECT DISTINCT domain FROM notifications WHERE id = ? AND user_name = ?", (notification_id, user_name))]
+            if domains_changed:
+                conn.execute("DELETE FROM notifications WHERE id = ? AND user_name = ?", (notification_id, user_name))
+                self._bump_version(conn, [['delete', domain, {'id': notification_id, 'user_name': user_name}]
+                                          for domain in domains_changed])
+        return domains_changed
+
+    def delete_notifications(self, notification_ids: list, user_name: str) -> dict:
+        """
+        Delete many notifications in a single transaction.
+        Returns a dict of notification id -> domains it was removed from, for the ids that were found.
+        """
+        deleted = {}
+        with self._connection() as conn:
+            for notification_id in set(notification_ids):
+                for (domain,) in conn.execute(
+                        "SELECT DISTINCT domain FROM notifications WHERE id = ? AND user_name = ?", (notification_id, user_name)):
+                    deleted.setdefault(notification_id, []).append(domain)
+            if deleted:
+                conn.executemany("DELETE FROM notifications WHERE id = ? AND user_name = ?",
+                                 [(notification_id, user_name) for notification_id in deleted])
+                self._bump_version(conn, [['delete', domain, {'id': notification_id, 'user_name': user_name}]
+                                          for notification_id, domains_changed in deleted.items()
+                                          for domain in domains_changed])
+        return deleted
+
+    def get_account_notifications(self, user_name: str) -> list:
+        return [
+            {'domain': domain, 'notification': json.loads(data)}
+            for domain, data in self._connection().execute(
+                "SELECT domain, data FROM notifications WHERE user_name = ? ORDER BY row_id", (user_name,))
+        ]
+
+
+class MemoryStorage:
+    """
+    Keep a process-resident copy of another storage backend with a user_name index.
+    Reads only check the backend version stamp and apply the changes when another process wrote to the store.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._reset()
+        _memory_stores.add(self)
+
+    def _reset(self):
+        """
+        Drop the in-memory copy so it is reloaded on the next read.
+        """
+        self._lock = threading.RLock()
+        self._version = None
+        self._domains = {}
+        self._users = {}  # user_name -> [(domain, notification)]
+        self._user_versions = {}  # user_name -> digest of their notifications, see get_user_version
+        self._changes = deque()  # (version before, version after, changes) for the latest refreshes
+        self._changes_size = 0
+
+    def _refresh(self):
+        """
+        Bring the in-memory copy up to date with the backend.
+        Changes made since the last refresh are applied one by one, the whole store is only reloaded
+        when the backend no longer has them.
+        """
+        version = self.backend.version()
+        if version == self._version:
+            return
+        changes = None
+        if self._version is not None:
+            changes = self.backend.changes_since(self._version, version)
+        if changes is None:
+            self._domains = self.backend.get_domains()
+            self._users = {}
+            self._user_versions = {}
+            for domain, notifications in self._domains.items():
+                for notification in notifications:
+                    self._users.setdefault(notification.get('user_name'), []).append((domain, notification))
+            self._changes.clear()
+            self._changes_size = 0
+        else:
+            self._apply(changes)
+            self._changes.append((self._version, version, changes))
+            self._changes_size += len(changes)
+            while self._changes_size > MEMORY_CHANGES_KEEP and len(self._changes) > 1:
+                self._changes_size -= len(self._changes.popleft()[2])
+        self._version = version
+
+    def _apply(self, changes: list):
+        """
+        Apply backend changes to the in-memory copy.
+        """
+        removed = {}  # user_name -> {(domain, id)} deleted from their index
+        for op, domain, data in changes:
+            notifications = self._domains.setdefault(domain, [])
+            if op == 'put':
+                notification = dict(data)
+                user_name = notification.get('user_name')
+                for existing_notification in notifications:
+                    if existing_notification['type'] == notification['type'] and existing_notification['id'] == notification['id']:
+                        previous_user = existing_notification.get('user_name')
+                        # Update in place so the user index keeps pointing at it
+                        existing_notification.clear()
+                        existing_notification.update(notification)
+                        if previous_user != user_name:
+                            self._users[previous_user] = [(d, n) for d, n in self._users.get(previous_user, [])
+                                                          if n is not existing_notification]
+                            self._users.setdefault(user_name, []).append((domain, existing_notification))
+                            self._user_versions.pop(previous_user, None)
+                        break
+                else:
+                    notifications.append(notification)
+                    self._users.setdefault(user_name, []).append((domain, notification))
+            else:
+                user_name = data['user_name']
+                remaining = [n for n in notifications if n['id'] != data['id'] or n.get('user_name') != user_name]
+                removed.setdefault(user_name, set()).add((domain, data['id']))
+                self._domains[domain] = remaining
+            if not self._domains[domain]:
+                del self._domains[domain]
+            self._user_versions.pop(user_name, None)
+
+        for user_name, keys in removed.items():
+            if user_name in self._users:
+                self._users[user_name] = [(d, n) for d, n in self._users[user_name] if (d, n['id']) not in keys]
+
+    def _write(self, write):
+        """
+        Run a backend write and bring the in-memory copy up to date with it.
+        """
+        with self._lock, self.backend.lock():
+            self._refresh()
+            result = write()
+            self._refresh()
+            return result
+
+    def version(self):
+        return self.backend.version()
+
+    def changes_since(self, version) -> list | None:
+        """
+        Get the changes made to the store since version, or None if they are no longer kept
+        and the store has to be read again.
+        """
+        with self._lock:
+            self._refresh()
+            if version == self._version:
+                return []
+            changes = None
+            for before, _, entry_changes in self._changes:
+                if changes is None and before == version:
+                    changes = []
+                if changes is not None:
+                    changes.extend(entry_changes)
+            return changes
+
+    def lock(self):
+        """
+        Lock the store against writes from other processes.
+        """
+        return self.backend.lock()
+
+    def get_domains(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {domain: [dict(n) for n in notifications] for domain, notifications in self._domains.items()}
+
+    def get_domain_notifications(self, domain_list) -> dict:
+        """
+        Get copies of the notifications of some domains only.
+        """
+        with self._lock:
+            self._refresh()
+            return {domain: [dict(n) for n in self._domains[domain]] for domain in domain_list if domain in self._domains}
+
+    def get_notification_blocks(self) -> dict:
+        """
+        Get {domain: {notification id: blocks}} for the whole store without copying the notifications.
+        """
+        with self._lock:
+            self._refresh()
+            return {domain: {n['id']: n['blocks'] for n in notifications} for domain, notifications in self._domains.items()}
+
+    def add_notification(self, domain: str, notification: dict):
+        self._write(lambda: self.backend.add_notification(domain, notification))
+
+    def add_notifications(self, additions: list):
+        self._write(lambda: self.backend.add_notifications(additions))
+
+    def update_notification(self, domain: str, notification: dict):
+        self.update_notifications([(domain, notification)])
+
+    def update_notifications(self, updates: list):
+        self._write(lambda: self.backend.update_notifications(updates))
+
+    def delete_notification(self, notification_id: str, user_name: str) -> list:
+        return self._write(lambda: self.backend.delete_notification(notification_id, user_name))
+
+    def delete_notifications(self, notification_ids: list, user_name: str) -> dict:
+        return self._write(lambda: self.backend.delete_notifications(notification_ids, user_name))
+
+    def iter_account_notifications(self, user_name: str, after: str | None = None, chunk_size: int = 500):
+        """
+        Iterate over a user's notifications in id order, starting after the id after.
+        Ids never change so pages stay consistent whichever process serves them, and after doesn't have to still exist.
+        Copies are taken a chunk at a time so a large account is never copied all at once.
+        """
+        with self._lock:
+            self._refresh()
+            entries = sorted(self._users.get(user_name, []), key=lambda entry: entry[1]['id'])
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(entries, after, key=lambda entry: entry[1]['id'])
+
+        def generate():
+            for i in range(start, len(entries), chunk_size):
+                with self._lock:
+                    chunk = [{'domain': domain, 'notification': dict(notification)}
+                             for domain, notification in entries[i:i + chunk_size]]
+                yield from chunk
+
+        return generate()
+
+    def get_user_version(self, user_name: str) -> str:
+        """
+        Get a tag that changes whenever one of a user's notifications changes.
+        It is a digest of the user's notifications in this copy of the store, so it always describes
+        the same snapshot reads are served from and is the same in every process.
+        """
+        with self._lock:
+            self._refresh()
+            version = self._user_versions.get(user_name)
+            if version is None:
+                entries = sorted(self._users.get(user_name, []), key=lambda entry: (entry[1]['id'], entry[0]))
+                version = hashlib.sha1(json.dumps(entries, sort_keys=True).encode()).hexdigest()[:16]
+                self._user_versions[user_name] = version
+            return version
+
+    def get_account_notifications(self, user_name: str) -> list:
+        with self._lock:
+            self._refresh()
+            return [{'domain': domain, 'notification': dict(notification)}
+                    for domain, notification in self._users.get(user_name, [])]
+
+
+def get_storage():
+    """
+    Create the storage backend selected by STORAGE_BACKEND, kept in memory by MemoryStorage.
+    """
+    if not os.path.exists('data'):
+        os.makedirs('data')
+
+    if STORAGE_BACKEND == 'sqlite':
+        print(f"Using SQLite notification storage: {SQLITE_FILE}")
+        return MemoryStorage(SQLiteStorage())
+    if STORAGE_BACKEND != 'json':
+        print(f"Unknown storage backend {STORAGE_BACKEND}, using JSON storage.")
+    return MemoryStorage(JSONStorage())